@@ -0,0 +1,258 @@
+""" Online aggregation of replicates. Memory does not grow with the number of runs
+"""
+from statistics import NormalDist
+
+import numpy as np
+
+from profiler import ProfileSum
+
+
+def numbers(values):
+    # Plain floats for JSON. Cells never observed, or not finite, are None
+    return [x if np.isfinite(x) else None for x in np.asarray(values, dtype=float).tolist()]
+
+
+class OnlineStats:
+    """ Running count, mean and variance (Welford) and P-square quantile estimates (Jain and Chlamtac, 1985),
+        cell by cell over arrays of a fixed shape. Non-finite values are skipped
+    """
+
+    def __init__(self, shape, quantiles=(.05, .5, .95)):
+        self.shape = shape
+        self.quantiles = np.array(quantiles)
+        self.n = np.zeros(shape, dtype=np.int64)
+        self._mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        # P-square markers: heights q and positions pos, per quantile and cell
+        q = len(quantiles)
+        self.q = np.zeros((q, 5) + shape)
+        self.pos = np.tile(np.arange(1., 6.).reshape((1, 5) + (1, ) * len(shape)), (q, 1) + shape)
+        self.increments = np.stack([np.zeros(q), self.quantiles / 2, self.quantiles, (1 + self.quantiles) / 2,
+                                    np.ones(q)], axis=1).reshape((q, 5) + (1, ) * len(shape))
+
+    def update(self, x):
+        x = np.asarray(x, dtype=float)
+        ok = np.isfinite(x)
+        self.n += ok
+        delta = np.where(ok, x - self._mean, 0)
+        self._mean += np.where(ok, delta / np.maximum(self.n, 1), 0)
+        self.m2 += np.where(ok, delta * (x - self._mean), 0)
+        self._quantiles(x, ok)
+
+    def _quantiles(self, x, ok):
+        # First five observations of each cell fill the markers, kept sorted
+        filling = ok & (self.n <= 5)
+        if filling.any():
+            slot = np.clip(self.n - 1, 0, 4)
+            for j in range(5):
+                self.q[:, j] = np.where(filling & (slot == j), x, self.q[:, j])
+            ready = filling & (self.n == 5)
+            self.q = np.where(ready, np.sort(self.q, axis=1), self.q)
+        active = ok & (self.n > 5)
+        if not active.any():
+            return
+        q, pos = self.q, self.pos
+        # Cell k of the new observation, extremes are stretched if needed
+        q[:, 0] = np.where(active & (x < q[:, 0]), x, q[:, 0])
+        q[:, 4] = np.where(active & (x > q[:, 4]), x, q[:, 4])
+        k = np.clip((x >= q[:, 1:4]).sum(axis=1), 0, 3)
+        for j in range(1, 5):
+            pos[:, j] += active & (k < j)
+        desired = 1 + (self.n - 1) * self.increments
+        # Adjust the three middle markers
+        for i in range(1, 4):
+            d = desired[:, i] - pos[:, i]
+            move = active & (((d >= 1) & (pos[:, i + 1] - pos[:, i] > 1)) |
+                             ((d <= -1) & (pos[:, i - 1] - pos[:, i] < -1)))
+            if not move.any():
+                continue
+            d = np.sign(d)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q[:, i] + d / (pos[:, i + 1] - pos[:, i - 1]) * \
+                    ((pos[:, i] - pos[:, i - 1] + d) * (q[:, i + 1] - q[:, i]) / (pos[:, i + 1] - pos[:, i]) +
+                     (pos[:, i + 1] - pos[:, i] - d) * (q[:, i] - q[:, i - 1]) / (pos[:, i] - pos[:, i - 1]))
+                neighbour_q = np.where(d > 0, q[:, i + 1], q[:, i - 1])
+                neighbour_pos = np.where(d > 0, pos[:, i + 1], pos[:, i - 1])
+                linear = q[:, i] + d * (neighbour_q - q[:, i]) / (neighbour_pos - pos[:, i])
+            inside = (q[:, i - 1] < parabolic) & (parabolic < q[:, i + 1])
+            q[:, i] = np.where(move, np.where(inside, parabolic, linear), q[:, i])
+            pos[:, i] += np.where(move, d, 0)
+
+    @property
+    def mean(self):
+        return np.where(self.n > 0, self._mean, np.nan)
+
+    @property
+    def var(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.n > 1, self.m2 / (self.n - 1), np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def quantile(self, p):
+        """ Estimate of quantile p, one of those given at creation.
+            Below five observations, the nearest of the sorted ones
+        """
+        j = list(self.quantiles).index(p)
+        few = np.sort(np.where(np.arange(5).reshape((5, ) + (1, ) * len(self.shape)) < self.n, self.q[j],
+                               np.inf), axis=0)
+        index = np.clip(np.round(p * (self.n - 1)).astype(int), 0, 4)
+        early = np.take_along_axis(few, index[None], axis=0)[0]
+        return np.where(self.n > 5, self.q[j, 2], np.where(self.n > 0, early, np.nan))
+
+    def half_width(self, confidence=.95):
+        # Half width of the normal confidence interval of the mean
+        z = NormalDist().inv_cdf(.5 + confidence / 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return z * self.std / np.sqrt(self.n)
+
+    def interval(self, confidence=.95):
+        h = self.half_width(confidence)
+        return self.mean - h, self.mean + h
+
+
+class Paired:
+    """ Differences and ratios of each policy arm to the baseline at the same level, replicate by replicate.
+        Meant for common random numbers, when replicate i of every arm shares its random streams.
+        A result only waits in memory until its partner arrives, or until every arm has stopped short of it
+    """
+
+    def __init__(self, arms, shape, quantiles=(.05, .5, .95)):
+        self.arms = [a for a in arms if a is not None]
+        self.shape = shape
+        self.quantiles = quantiles
+        self.waiting = dict()
+        self.paired = dict()
+        # Replicates run by each (arm, level) that stopped early. See stop
+        self.stopped = dict()
+        self.differences = dict()
+        self.ratios = dict()
+
+    def add(self, task, values):
+        pol, level, i = task[:3]
+        slot = self.waiting.setdefault((level, i), dict())
+        slot[pol] = values
+        if None not in slot:
+            return
+        for arm in [a for a in slot if a is not None]:
+            self._pair(arm, level, i, slot.pop(arm), slot[None])
+        self._release(level, i)
+
+    def stop(self, arm, level, n):
+        # Arm ran its last replicate at level: baselines of replicates n and beyond no longer wait for it
+        self.stopped[arm, level] = n
+        for key in [k for k in self.waiting if k[0] == level and k[1] >= n]:
+            self._release(*key)
+
+    def _release(self, level, i):
+        expected = sum(i < self.stopped.get((arm, level), i + 1) for arm in self.arms)
+        if None in self.waiting[level, i] and self.paired.get((level, i), 0) == expected:
+            del self.waiting[level, i]
+            self.paired.pop((level, i), None)
+
+    def _pair(self, arm, level, i, values, baseline):
+        key = arm, level
+        if key not in self.differences:
+            self.differences[key] = OnlineStats(self.shape, self.quantiles)
+            self.ratios[key] = OnlineStats(self.shape, self.quantiles)
+        self.differences[key].update(values - baseline)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Zero baselines give non-finite ratios, which are skipped
+            self.ratios[key].update(values / baseline)
+        self.paired[level, i] = self.paired.get((level, i), 0) + 1
+
+
+class Aggregator:
+    """ OnlineStats of every (policy, level), fed RunResults as they stream in.
+        Cells are the ticks and metrics each RunResult carries.
+        With paired=<policies>, also paired differences and ratios to the baseline (see Paired)
+    """
+
+    def __init__(self, metrics, ticks, quantiles=(.05, .5, .95), paired=None):
+        # Metrics may be None: taken from the first result
+        self.metrics = None if metrics is None else list(metrics)
+        self.ticks = list(ticks)
+        self.quantiles = quantiles
+        self.arms = paired
+        self.paired = None
+        self.stats = dict()
+        # Summed phase times and event counts, for runs with params.profile on
+        self.profiles = dict()
+
+    def add(self, task, result):
+        pol, level = task[:2]
+        key = pol, level
+        if self.metrics is None:
+            self.metrics = list(result.metrics)
+        if key not in self.stats:
+            self.stats[key] = OnlineStats((len(self.ticks), len(self.metrics)), self.quantiles)
+        self.stats[key].update(result.values)
+        if result.profile is not None:
+            self.profiles.setdefault(key, ProfileSum()).add(result.profile)
+        if self.arms is not None:
+            if self.paired is None:
+                self.paired = Paired(self.arms, (len(self.ticks), len(self.metrics)), self.quantiles)
+            self.paired.add(task, result.values)
+
+    def stop(self, pol, level, n):
+        # Adaptive replication stopped (pol, level) after n replicates
+        if self.paired is not None and pol is not None:
+            self.paired.stop(pol, level, n)
+
+    def __getitem__(self, key):
+        return self.stats[key]
+
+    def runs(self):
+        # Fewest and most runs of any (policy, level). The same unless replication was adaptive
+        counts = [int(s.n.max()) for s in self.stats.values()]
+        return min(counts), max(counts)
+
+    def cell(self, metric, tick=None):
+        # Index of (tick, metric) in the arrays. Defaults to the last tick
+        return self.ticks.index(self.ticks[-1] if tick is None else tick), self.metrics.index(metric)
+
+    def mean(self, pol, level, metric, tick=None):
+        return self.stats[pol, level].mean[self.cell(metric, tick)]
+
+    def band(self, pol, level, metric, tick=None, confidence=.95):
+        low, high = self.stats[pol, level].interval(confidence)
+        c = self.cell(metric, tick)
+        return low[c], high[c]
+
+    def ratio(self, pol, level, metric, tick=None, confidence=.95):
+        # Paired ratio to the baseline: mean and confidence interval
+        s = self.paired.ratios[pol, level]
+        low, high = s.interval(confidence)
+        c = self.cell(metric, tick)
+        return s.mean[c], low[c], high[c]
+
+    def _numbers(self, stats):
+        out = dict()
+        for (pol, level), s in stats.items():
+            values = {'n': s.n, 'mean': s.mean, 'std': s.std}
+            values.update({f'q{p}': s.quantile(p) for p in self.quantiles})
+            out.setdefault(str(pol), dict())[str(level)] = \
+                {name: {str(t): dict(zip(self.metrics, numbers(v[j])))
+                        for j, t in enumerate(self.ticks)} for name, v in values.items()}
+        return out
+
+    def to_dict(self):
+        # Plain numbers by policy, level, statistic and metric, at each tick. Valid JSON: no NaN
+        out = self._numbers(self.stats)
+        if self.paired is not None:
+            out['paired'] = {'difference': self._numbers(self.paired.differences),
+                             'ratio': self._numbers(self.paired.ratios)}
+        if self.profiles:
+            out['profile'] = dict()
+            for (pol, level), p in self.profiles.items():
+                out['profile'].setdefault(str(pol), dict())[str(level)] = p.to_dict()
+        return out
+
+    def profile(self):
+        # Profiles of all runs added, summed
+        total = ProfileSum()
+        for p in self.profiles.values():
+            total.add(p.totals, p.runs)
+        return total.to_dict()
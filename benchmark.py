@@ -0,0 +1,148 @@
+""" Benchmark of single runs over a matrix of population, firms, T, policies and criteria.
+    Each case runs in a fresh process, so that its peak memory is its own.
+    Usage:
+        python benchmark.py run [output.json] [--quick] [--repeat 3]
+        python benchmark.py compare baseline.json current.json [--tolerance .1]
+    compare flags cases slower, or with a higher peak memory, than the baseline by more than tolerance,
+    and exits with status 1 if there is any
+"""
+import datetime
+import itertools
+import json
+import multiprocessing
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import cache
+import model
+from parameters import Parameters
+
+try:
+    import resource
+except ImportError:
+    # Windows. Peak memory is then traced by Python, which slows runs down
+    resource = None
+
+# Axes of the matrix. firms multiplies the number of firms of each region in params.regions_firms
+MATRIX = {'num_consumers': [2000, 20000, 200000, 1000000],
+          'firms': [1, 4],
+          'T': [40],
+          'policy': [None, 'tax', 'p_d', 'e_max'],
+          'number_characteristics': [2, 4],
+          'demand_engine': ['agents', 'vectorized'],
+          'supply_engine': ['firms', 'vectorized'],
+          'selection': ['legacy', 'argmax']}
+QUICK = {'num_consumers': [2000, 20000],
+         'firms': [1],
+         'T': [10],
+         'policy': [None, 'tax'],
+         'number_characteristics': [2],
+         'demand_engine': ['agents', 'vectorized'],
+         'supply_engine': ['firms', 'vectorized'],
+         'selection': ['legacy', 'argmax']}
+# One Consumer object per consumer does not go beyond this
+AGENTS_MAX = 200000
+LEVEL = 1.0
+
+
+def cases(matrix):
+    for values in itertools.product(*matrix.values()):
+        case = dict(zip(matrix, values))
+        if case['demand_engine'] == 'agents' and case['num_consumers'] > AGENTS_MAX:
+            continue
+        yield case
+
+
+def name(case):
+    return ','.join(f'{k}={v}' for k, v in case.items())
+
+
+def measure(case, repeat=1):
+    # Best wall time of repeat runs, phase times of that run and peak memory of the process
+    base = Parameters()
+    params = Parameters(num_consumers=case['num_consumers'], T=case['T'],
+                        regions_firms={r: n * case['firms'] for r, n in base.regions_firms.items()},
+                        number_characteristics=case['number_characteristics'],
+                        demand_engine=case['demand_engine'], supply_engine=case['supply_engine'],
+                        selection=case['selection'], profile=True)
+    if resource is None:
+        tracemalloc.start()
+    best, phases = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        sim = model.Simulation({'policy': case['policy'], 'level': LEVEL}, seed=True, params=params)
+        sim.controller()
+        seconds = time.perf_counter() - t0
+        if best is None or seconds < best:
+            best, phases = seconds, sim.profiler.to_dict()['time']
+        del sim
+    if resource is None:
+        peak = tracemalloc.get_traced_memory()[1]
+    else:
+        # Kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {'seconds': best,
+            'ticks_per_sec': case['T'] / best,
+            'consumers_per_sec': case['num_consumers'] * case['T'] / best,
+            'peak_mb': peak / 1024 ** 2,
+            'phases': phases}
+
+
+def run(matrix, output, repeat=1):
+    out = {'meta': {'date': datetime.datetime.utcnow().isoformat(), 'code_version': cache.code_version(),
+                    'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.platform(),
+                    'processor': platform.processor(), 'repeat': repeat},
+           'cases': dict()}
+    context = multiprocessing.get_context('spawn')
+    for case in cases(matrix):
+        with context.Pool(1) as pool:
+            out['cases'][name(case)] = result = pool.apply(measure, (case, repeat))
+        print(f"{name(case):<140}{result['seconds']:>9.2f}s {result['ticks_per_sec']:>8.2f} ticks/s "
+              f"{result['consumers_per_sec']:>12,.0f} consumers/s {result['peak_mb']:>8.0f} MB")
+        # Written after each case, so that a long benchmark can be stopped and still leave its results
+        with open(output, 'w') as f:
+            json.dump(out, f, indent=1)
+    return out
+
+
+def compare(baseline, current, tolerance=.1):
+    """ Ratios current / baseline of time and peak memory for the cases in both files.
+        Returns the names of the cases regressed beyond tolerance
+    """
+    with open(baseline) as f:
+        old = json.load(f)['cases']
+    with open(current) as f:
+        new = json.load(f)['cases']
+    regressions = list()
+    for case in [c for c in new if c in old]:
+        time_ratio = new[case]['seconds'] / old[case]['seconds']
+        memory_ratio = new[case]['peak_mb'] / old[case]['peak_mb']
+        flag = time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance
+        if flag:
+            regressions.append(case)
+        print(f"{'REGRESSION ' if flag else '':<11}{case:<140}time x{time_ratio:.2f} memory x{memory_ratio:.2f}")
+        if flag:
+            # Phases that slowed down the most
+            phases = {p: new[case]['phases'][p] / old[case]['phases'][p]
+                      for p in new[case]['phases'] if old[case]['phases'].get(p)}
+            for p in sorted(phases, key=phases.get, reverse=True)[:3]:
+                print(f"{'':<15}{p:<20}x{phases[p]:.2f}")
+    missing = [c for c in old if c not in new]
+    if missing:
+        print(f'{len(missing)} cases of the baseline were not run')
+    return regressions
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    command = args.pop(0) if args else 'run'
+    options = {args[j]: args[j + 1] for j in range(len(args)) if args[j] in ('--repeat', '--tolerance')}
+    files = [a for a in args if not a.startswith('--') and a not in options.values()]
+    if command == 'compare':
+        sys.exit(1 if compare(files[0], files[1], float(options.get('--tolerance', .1))) else 0)
+    run(QUICK if '--quick' in args else MATRIX, files[0] if files else 'benchmark.json',
+        int(options.get('--repeat', 1)))
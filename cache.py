@@ -0,0 +1,145 @@
+""" On-disk cache of finished runs, so that interrupted or extended sweeps only run what is missing.
+    Usage: python cache.py [info | clear | prune] [path]
+"""
+import glob
+import hashlib
+import os
+import pickle
+import sys
+import types
+
+from parameters import override
+
+_code_version = None
+
+
+def sources():
+    """ Files of the modules a run executes: model and, recursively, the modules of this folder it imports from.
+        Found from the imported names, so that new modules are never left out of the code version
+    """
+    import model
+    here = os.path.dirname(os.path.abspath(__file__))
+    found, pending = dict(), [model]
+    while pending:
+        module = pending.pop()
+        file = getattr(module, '__file__', None)
+        if module.__name__ in found or not file or os.path.dirname(os.path.abspath(file)) != here:
+            continue
+        found[module.__name__] = file
+        for value in vars(module).values():
+            name = value.__name__ if isinstance(value, types.ModuleType) else getattr(value, '__module__', None)
+            if isinstance(name, str) and name in sys.modules:
+                pending.append(sys.modules[name])
+    return [found[name] for name in sorted(found)]
+
+
+def code_version():
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        for file in sources():
+            with open(file, 'rb') as f:
+                digest.update(f.read())
+        _code_version = digest.hexdigest()[:12]
+    return _code_version
+
+
+class RunCache:
+    """ RunResults pickled under <path>/<code version>/<key>.pkl.
+        The key hashes the effective parameters, policy, level, replicate, seed stream and requested output.
+        Least recently used entries are evicted once the cache grows beyond max_bytes.
+        Only reproducible runs are cached: execute skips the cache for unseeded runs (seed=False and no root),
+        whose key would not tell one random replicate from another
+    """
+
+    def __init__(self, path='cache', max_bytes=2 * 1024 ** 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Eviction goes down to this fraction of max_bytes, so that it runs rarely
+        self.low = .9
+        self.hits = 0
+        # Total size on disk, measured once and then kept up to date
+        self._size = None
+
+    def key(self, task, seed=True, param=None, value=None, metrics=None, ticks=None, full=False, root=None,
+            crn=False, params=None, **_):
+        # params: the Parameters of the task, when the caller has already built them
+        pol, level, i = task[:3]
+        if len(task) > 3:
+            # Task carrying its own sensitivity override
+            param, value = task[3:]
+        if params is None:
+            params = override(param, value)
+        content = [params.digest, pol, level, i, seed, root, crn, metrics, ticks, full]
+        return hashlib.sha256(repr(content).encode()).hexdigest()
+
+    def file(self, key):
+        return os.path.join(self.path, code_version(), f'{key}.pkl')
+
+    def get(self, key):
+        file = self.file(key)
+        if not os.path.exists(file):
+            return None
+        with open(file, 'rb') as f:
+            result = pickle.load(f)
+        # Mark as recently used
+        os.utime(file)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        file = self.file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        if self._size is None:
+            self._size = self.size()
+        # An entry written again replaces the old one, which no longer counts
+        if os.path.exists(file):
+            self._size -= os.path.getsize(file)
+        # Write then rename, so that a crash never leaves a partial entry behind
+        with open(file + '.tmp', 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file + '.tmp', file)
+        self._size += os.path.getsize(file)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        return glob.glob(os.path.join(self.path, '*', '*.pkl'))
+
+    def size(self):
+        return sum(os.path.getsize(f) for f in self.entries())
+
+    def evict(self):
+        # Removes the oldest entries until the cache is back under the low-water mark
+        entries = sorted(self.entries(), key=os.path.getmtime)
+        for oldest in entries:
+            if self._size <= self.low * self.max_bytes:
+                break
+            self._size -= os.path.getsize(oldest)
+            os.remove(oldest)
+
+    def clear(self):
+        for f in self.entries():
+            os.remove(f)
+        self._size = 0
+
+    def prune(self):
+        # Removes entries computed by other versions of the code. They can never be hit again
+        for f in self.entries():
+            if os.path.basename(os.path.dirname(f)) != code_version():
+                os.remove(f)
+        self._size = None
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'info'
+    cache = RunCache(sys.argv[2] if len(sys.argv) > 2 else 'cache')
+    if command == 'clear':
+        cache.clear()
+    elif command == 'prune':
+        cache.prune()
+    print(f'{len(cache.entries())} runs, {cache.size() / 1024 ** 2:,.1f} MB at {cache.path}. '
+          f'Code version {code_version()}')
+    if command == 'info':
+        # Any module missing here would let edits to it serve stale runs
+        print(f'Hashed: {", ".join(os.path.basename(f) for f in sources())}')
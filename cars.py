@@ -8,7 +8,15 @@ class Vehicle:
 
         CO2 emission reduction is the goal
         """
+    __slots__ = ['type', '_production_cost', '_EE', '_EC', 'QL', 'firm', 'sales_price', 'owed_taxes',
+                 '_emissions', '_drive_range', '_priced']
+
     def __init__(self, firm, _type='gas', production_cost=None, ee=None, ec=None, ql=None):
+        # Derived values are cached. Changing production_cost, EE or EC clears the ones they affect
+        self._emissions = None
+        self._drive_range = None
+        # Policy situation the current sales price and taxes were calculated for. None: to be calculated
+        self._priced = None
         # Type: 'combustion' or 'electric', 'gas' or 'green'
         self.type = _type
         # Price (production_cost)
@@ -23,17 +31,57 @@ class Vehicle:
         self.sales_price = None
         self.calculate_price()
         self.owed_taxes = 0
+        # Taxes are only owed from the next calculation on
+        self._priced = None
+
+    @property
+    def production_cost(self):
+        return self._production_cost
+
+    @production_cost.setter
+    def production_cost(self, value):
+        self._production_cost = value
+        self._priced = None
+
+    @property
+    def EE(self):
+        return self._EE
+
+    @EE.setter
+    def EE(self, value):
+        self._EE = value
+        self._emissions = None
+        self._drive_range = None
+        # Taxes of the e_max policy depend on emissions
+        self._priced = None
+
+    @property
+    def EC(self):
+        return self._EC
+
+    @EC.setter
+    def EC(self, value):
+        self._EC = value
+        self._drive_range = None
 
     def drive_range(self):
         # Driving range (DR)
-        return self.EE * self.EC
+        if self._drive_range is None:
+            self._drive_range = self.EE * self.EC
+        return self._drive_range
 
     def emissions(self):
-        return self.firm.sim.params.emission[self.type]/self.EE
+        if self._emissions is None:
+            self._emissions = self.firm.sim.params.emission[self.type]/self.EE
+        return self._emissions
 
     def calculate_price(self):
         # policy_value é DESCONTO. policy_tax é SOBRETAXA OU DESCONTO NA TAXA
         # Politica Brasileira: descontar do IPI  no minimo 3% quando a fabrica inicia desenvolvimento do carro eletrico
+        # Prices only change with the car itself or, under e_max, with the benchmark e of the tick
+        situation = (self.firm.sim.e, ) if self.firm.sim.policy['policy'] == 'e_max' else ()
+        if self._priced == situation:
+            return self.owed_taxes
         policy_tax = 0
         if self.firm.sim.policy['policy'] == 'tax':
             policy_tax = self.firm.sim.params.tax[self.firm.sim.policy['level']]
@@ -52,23 +100,9 @@ class Vehicle:
         self.owed_taxes = (policy_tax + self.firm.sim.params.pis[self.type] +
                            self.firm.sim.params.cofins[self.type] +
                            self.firm.sim.params.ipi[self.type]) * self.production_cost
+        self._priced = situation
         return self.owed_taxes
 
     def criteria_selection(self, emotion, region, *criteria):
-        ms1 = self.firm.market_share[self.type][self.firm.sim.t]
-        # Included FREIGHT from firm region to consumer region!
-        # Included ICMS charged on DESTIN. That is, the region of the CONSUMER
-        criterion = {'car_affordability': 1 / ((self.sales_price * (1 + self.firm.sim.params.icms[region])) +
-                                               self.firm.sim.params.freight[self.firm.region][region]),
-                     'use_affordability': 1 / self.firm.sim.params.price_energy[region][self.type],
-                     'stations': self.firm.sim.green_stations[self.firm.sim.t] if self.type == 'green'
-                     else self.firm.sim.params.stations['gas'],
-                     'market_share': max(ms1, self.firm.sim.params.epsilon),
-                     'energy_capacity': self.EC,
-                     'car_cleanness': 1 / self.emissions(),
-                     'quality': self.QL,
-                     'emotion': emotion}
-        res = 1
-        for c in criteria[0]:
-            res *= criterion[c]
-        return res
+        # Criteria values come from the offer table built for this tick
+        return self.firm.sim.offers.score(self, region, emotion, criteria[0])
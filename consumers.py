@@ -1,3 +1,4 @@
+from market import CRITERIA
 
 
 class Consumer:
@@ -8,52 +9,74 @@ class Consumer:
         self.id = _id
         self.region = region
         self.params = sim.params
-        self.price_max = sim.seed.normalvariate(self.params.p_max['mu'],
-                                                self.params.p_max['sigma'] * self.params.p_max_proportion[self.region])
+        self.price_max = sim.streams['agents'].normalvariate(self.params.p_max['mu'],
+                                                             self.params.p_max['sigma'] *
+                                                             self.params.p_max_proportion[self.region])
         self.my_car = None
-        self.distance = sim.seed.normalvariate(self.params.distance['mu'], self.params.distance['sigma'])
+        self.distance = sim.streams['agents'].normalvariate(self.params.distance['mu'], self.params.distance['sigma'])
 
     def purchase(self, sim):
+        seed = sim.streams['purchase']
         # Probability to buy a new car: self.params.prob_adoption
-        if not sim.seed.random() < self.params.prob_adoption:
+        if not seed.random() < self.params.prob_adoption:
             return
         # Conditions to enter the market
         # 1. Condition, car price less than my reserve price and can go the distance
         # Dk: minimum distance parameter
-        choice = sim.seed.random()
+        choice = seed.random()
         # Calculate needed range
         if choice < .23:
-            dk = sim.seed.uniform(self.params.dk['23']['min'], self.params.dk['23']['max'])
+            dk = seed.uniform(self.params.dk['23']['min'], self.params.dk['23']['max'])
         elif choice < .45:
-            dk = sim.seed.uniform(self.params.dk['22']['min'], self.params.dk['22']['max'])
+            dk = seed.uniform(self.params.dk['22']['min'], self.params.dk['22']['max'])
         else:
-            dk = sim.seed.uniform(self.params.dk['55']['min'], self.params.dk['55']['max'])
+            dk = seed.uniform(self.params.dk['55']['min'], self.params.dk['55']['max'])
         # Policy introduced here. When testing policy e_max will be endogenously set
         # My market includes affordable cars, within needed range and within regulation, if applicable.
-        my_market = [car for firm in sim.firms.values() for car in firm.cars.values()
-                     if car.sales_price < self.price_max and car.drive_range() > dk and
-                     car.emissions() < sim.e_max]
+        profiler = sim.profiler
+        with profiler.phase('demand.market'):
+            my_market = sim.offers.market(self.price_max, dk)
         # Stop if no cars in pre-selection above
         if not my_market:
             return
+        profiler.count('markets')
+        profiler.count('market_cars', len(my_market))
+        profiler.count('cars_scored', len(my_market))
 
         # Choose two criteria to evaluate among possible purchases
-        criteria = ['car_affordability', 'use_affordability', 'stations', 'market_share',
-                    'energy_capacity', 'car_cleanness', 'quality', 'emotion']
+        criteria = CRITERIA
 
         # Value that represents consumer emotion (brand). It can change at each t.
-        emotion = sim.seed.random()
-        # In case the criteria are identical
-        sim.seed.shuffle(my_market)
-        my_market.sort(key=lambda c: c.criteria_selection(emotion, self.region,
-                                                          sim.seed.sample(criteria,
-                                                                          k=sim.params.number_characteristics)),
-                       reverse=True)
-
-        self.my_car = my_market[0]
+        emotion = seed.random()
+        old = self.my_car
+        if sim.params.selection == 'legacy':
+            # In case the criteria are identical
+            with profiler.phase('demand.sorting'):
+                seed.shuffle(my_market)
+                my_market.sort(key=lambda c: c.criteria_selection(emotion, self.region,
+                                                                  seed.sample(criteria,
+                                                                              k=sim.params.number_characteristics)),
+                               reverse=True)
+            self.my_car = my_market[0]
+        else:
+            with profiler.phase('demand.scoring'):
+                self.my_car = self.best_car(seed, my_market, emotion,
+                                            seed.sample(criteria, k=sim.params.number_characteristics))
         self.my_car.firm.sales(self.my_car.type)
         sim.update_car_info(self.my_car.type)
+        sim.fleet.buy(self.region, self.distance, old, self.my_car)
+        profiler.count('purchases')
 
-    def driving(self):
-        # Return emissions
-        return self.distance * self.my_car.emissions() if self.my_car else 0
+    def best_car(self, seed, my_market, emotion, criteria):
+        # Single pass. The same criteria are used for every car. Ties are broken at random, each tied car
+        # replaces the current best with probability 1 / number of ties so far
+        best, best_score, ties = None, None, 0
+        for car in my_market:
+            score = car.criteria_selection(emotion, self.region, criteria)
+            if best is None or score > best_score:
+                best, best_score, ties = car, score, 1
+            elif score == best_score:
+                ties += 1
+                if seed.random() * ties < 1:
+                    best = car
+        return best
@@ -0,0 +1,116 @@
+import numpy as np
+
+from ledger import TECHS
+from market import CRITERIA
+
+
+class Population:
+    """ Vectorized demand engine. Consumers are kept as arrays and all of them are scored against all cars at once.
+        Writes the same sold cars (sim.ledger) and num_cars counters as Consumer.purchase
+    """
+
+    def __init__(self, sim):
+        self.params = sim.params
+        self.rng = np.random.default_rng(sim.streams['agents'].getrandbits(64))
+        # Purchases draw from a generator of their own. See SITES in model.py
+        self.purchase_rng = np.random.default_rng(sim.streams['purchase'].getrandbits(64))
+        self.regions = list(self.params.regions_consumers.keys())
+        self.n = self.params.num_consumers
+        weights = np.array(list(self.params.regions_consumers.values()))
+        self.region = self.rng.choice(len(self.regions), size=self.n, p=weights / weights.sum()).astype(np.int8)
+        proportion = np.array([self.params.p_max_proportion[r] for r in self.regions])
+        self.price_max = self.rng.normal(self.params.p_max['mu'],
+                                         self.params.p_max['sigma'] * proportion[self.region])
+        self.distance = self.rng.normal(self.params.distance['mu'], self.params.distance['sigma'], size=self.n)
+        # Slot of my car in sim.fleet, -1 if none. The car itself is sim.fleet.cars[slot]
+        self.car_slot = np.full(self.n, -1)
+
+    def __len__(self):
+        return self.n
+
+    def count(self, region):
+        return int((self.region == self.regions.index(region)).sum())
+
+    def purchase(self, sim):
+        # Probability to buy a new car: self.params.prob_adoption
+        buyers = np.flatnonzero(self.purchase_rng.random(self.n) < self.params.prob_adoption)
+        offers = sim.offers
+        if not buyers.size or not len(offers):
+            return
+        # Needed range, same brackets as Consumer.purchase
+        choice = self.purchase_rng.random(buyers.size)
+        low = np.select([choice < .23, choice < .45],
+                        [self.params.dk['23']['min'], self.params.dk['22']['min']], self.params.dk['55']['min'])
+        high = np.select([choice < .23, choice < .45],
+                         [self.params.dk['23']['max'], self.params.dk['22']['max']], self.params.dk['55']['max'])
+        dk = self.purchase_rng.uniform(low, high)
+        # Value that represents consumer emotion (brand)
+        emotion = self.purchase_rng.random(buyers.size)
+        # Scores are products of criteria, computed as sums of logs
+        log_table = np.log(offers.values)
+        # With 'argmax' selection the criteria are drawn once per buyer
+        selected = self.select_criteria(buyers.size) if self.params.selection == 'argmax' else None
+        # Number of affordable cars for each buyer, from the price-sorted market index
+        affordable = np.searchsorted(offers.sorted_price, self.price_max[buyers], side='left')
+
+        chosen = np.full(buyers.size, -1)
+        step = self.params.demand_chunk
+        profiler = sim.profiler
+        for r in range(len(self.regions)):
+            group = np.flatnonzero(self.region[buyers] == r)
+            for start in range(0, group.size, step):
+                rows = group[start:start + step]
+                # Only the cheapest cars anyone in the chunk can afford need scoring
+                cols = offers.order[:affordable[rows].max()]
+                if not cols.size:
+                    continue
+                # My market: affordable cars, within needed range and within regulation, if applicable
+                with profiler.phase('demand.market'):
+                    market = (np.arange(cols.size) < affordable[rows, None]) & \
+                             (offers.drive_range[cols] > dk[rows, None])
+                with profiler.phase('demand.scoring'):
+                    score = np.where(market, self.score(log_table[cols, r], emotion[rows],
+                                                            None if selected is None else selected[rows]), -np.inf)
+                with profiler.phase('demand.sorting'):
+                    best = score.max(axis=1)
+                    # In case the criteria are identical, pick randomly among the best
+                    ties = market & (score == best[:, None])
+                    pick = np.argmax(np.where(ties, self.purchase_rng.random(ties.shape), -1), axis=1)
+                    chosen[rows] = np.where(market.any(axis=1), cols[pick], -1)
+                if profiler.active:
+                    sizes = market.sum(axis=1)
+                    profiler.count('markets', int((sizes > 0).sum()))
+                    profiler.count('market_cars', int(sizes.sum()))
+                    profiler.count('cars_scored', score.size)
+
+        bought = chosen >= 0
+        profiler.count('purchases', int(bought.sum()))
+        owners = buyers[bought]
+        cars, which = np.unique(chosen[bought], return_inverse=True)
+        slots = np.array([sim.fleet.slot(offers.cars[i]) for i in cars.tolist()], dtype=int)[which]
+        sim.fleet.buy_many(self.region[owners].astype(int), self.distance[owners], self.car_slot[owners], slots)
+        self.car_slot[owners] = slots
+        for car, sold in zip(offers.cars, np.bincount(chosen[bought], minlength=len(offers))):
+            if sold:
+                sim.ledger.sold_cars[car.firm.row, TECHS[car.type], sim.t] += sold
+                sim.num_cars[car.type][sim.t] += int(sold)
+
+    def select_criteria(self, n):
+        # Mask of number_characteristics criteria, drawn without replacement for each of n consumers
+        picks = np.argsort(self.purchase_rng.random((n, len(CRITERIA))), axis=1)[:, :self.params.number_characteristics]
+        selected = np.zeros((n, len(CRITERIA)), dtype=bool)
+        np.put_along_axis(selected, picks, True, axis=1)
+        return selected
+
+    def score(self, log_table, emotion, selected=None):
+        with np.errstate(divide='ignore'):
+            log_emotion = np.log(emotion)
+        if selected is not None:
+            # 'argmax': one set of criteria per consumer, the sum of logs is a matrix product
+            return selected[:, :-1].astype(float) @ log_table.T + np.where(selected[:, -1], log_emotion, 0)[:, None]
+        # 'legacy': as in Consumer.purchase, criteria are sampled for each car a consumer evaluates
+        values = np.concatenate([np.broadcast_to(log_table, (emotion.size, ) + log_table.shape),
+                                 np.broadcast_to(log_emotion[:, None, None], (emotion.size, log_table.shape[0], 1))],
+                                axis=2)
+        picks = np.argsort(self.purchase_rng.random(values.shape), axis=2)[..., :self.params.number_characteristics]
+        return np.take_along_axis(values, picks, axis=2).sum(axis=2)
@@ -0,0 +1,77 @@
+""" Structured tracing of what firms and the government do during a run.
+    Events are appended to typed columns and only turned into text when printed
+"""
+from array import array
+
+import numpy as np
+import pandas as pd
+from colorama import Fore
+
+TECHS = ['gas', 'green', 'hybrid']
+# Kind of event: colour and message of the console output. Fields: t, firm, tech, value, extra
+KINDS = {'adoption_probability': (Fore.LIGHTRED_EX, 'Prob. adoption of a new portfolio: {value:.4f}'),
+         'adoption': (Fore.LIGHTYELLOW_EX, 'Great news. Firm {firm} has adopted a new {tech} portfolio at time {t}'),
+         'investment': (Fore.LIGHTCYAN_EX, 'Advertise material. We, at firm {firm}, have made an investment on {tech} '
+                                           'of {value:,.2f}'),
+         'cost_reduction': (Fore.GREEN, 'Production cost reduced by {value:,.2f}'),
+         'quality': (Fore.MAGENTA, 'Quality increased by {value:,.4f}'),
+         'energy_economy': (Fore.LIGHTYELLOW_EX, 'Energy economy increased by {value:,.4f}'),
+         'energy_capacity': (Fore.GREEN, 'Energy capacity increased by {value:,.4f}'),
+         'roi': ('', 'ROI for firm {firm} is {value:.2f}'),
+         'abandonment': (Fore.LIGHTRED_EX, 'Abandoning portfolio {tech}: firm {firm} at time {t}'),
+         'bankruptcy': (Fore.LIGHTMAGENTA_EX, 'Firm {firm} has gone bankrupt at time {t}'),
+         'new_firm': ('', 'New firm {firm} created'),
+         'e': ('', 'Parameter e -- sold cars emission average -- is {value:.4f}'),
+         'e_max': ('', 'Max emission for time {t} is {value:.2f}'),
+         'public': (Fore.RED, 'Government has paid/received total at this t {t} a net total of $ {value:,.2f}'),
+         'emissions': (Fore.RED, 'Emissions at t {t} was {value:,.2f}. Emissions index: {extra:.4f}')}
+NAMES = list(KINDS)
+CODES = {k: j for j, k in enumerate(NAMES)}
+# Typecodes of the columns
+COLUMNS = {'t': 'i', 'kind': 'b', 'firm': 'i', 'tech': 'b', 'value': 'd', 'extra': 'd'}
+
+
+def message(t, kind, firm=-1, tech=-1, value=np.nan, extra=np.nan):
+    # Coloured console line of an event, as given by the codes stored in the columns
+    colour, text = KINDS[NAMES[kind]]
+    return colour + text.format(t=t, firm=firm, tech=TECHS[tech] if tech >= 0 else None, value=value, extra=extra)
+
+
+def pretty(events):
+    # Console lines of exported events, e.g. RunResult.events
+    return [message(*row) for row in zip(*(events[c].tolist() for c in COLUMNS))]
+
+
+class Tracer:
+    """ Events of a run, appended to one typed array per field. Only created when tracing is on,
+        callers check sim.trace first, so that a run without it does no work at all.
+        With echo (a logger), each event is also logged as it happens, as the coloured console output
+    """
+
+    def __init__(self, echo=None):
+        self.columns = {c: array(code) for c, code in COLUMNS.items()}
+        self.echo = echo
+
+    def __call__(self, kind, t, firm=-1, tech=None, value=np.nan, extra=np.nan):
+        row = t, CODES[kind], firm, -1 if tech is None else TECHS.index(tech), value, extra
+        for column, v in zip(self.columns.values(), row):
+            column.append(v)
+        if self.echo is not None:
+            self.echo.info(message(*row))
+
+    @property
+    def size(self):
+        return len(self.columns['t'])
+
+    def arrays(self):
+        # Numpy copies of the columns. Picklable and cheap to send back from a worker
+        return {c: np.array(v) for c, v in self.columns.items()}
+
+    def frame(self):
+        events = pd.DataFrame(self.arrays())
+        events['kind'] = pd.Categorical.from_codes(events['kind'], NAMES)
+        events['tech'] = pd.Categorical.from_codes(events['tech'], TECHS)
+        return events
+
+    def messages(self):
+        return pretty(self.arrays())
@@ -0,0 +1,81 @@
+import numpy as np
+
+
+class Fleet:
+    """ Cars in use: total distance driven by the owners of each car, by consumer region.
+        Updated at each purchase, so that emissions of a tick are a sum over cars instead of over consumers.
+        Cars keep a slot while anyone owns them, also after they leave the market. Empty slots are reused
+    """
+
+    def __init__(self, regions, size=64):
+        self.regions = list(regions)
+        self.region_index = {r: j for j, r in enumerate(self.regions)}
+        self.cars = [None] * size
+        self.slots = dict()
+        self.free = list(range(size - 1, -1, -1))
+        self.distance = np.zeros((size, len(self.regions)))
+        self.owners = np.zeros(size, dtype=np.int64)
+
+    def slot(self, car):
+        if car not in self.slots:
+            if not self.free:
+                self.grow()
+            s = self.free.pop()
+            self.slots[car] = s
+            self.cars[s] = car
+        return self.slots[car]
+
+    def grow(self):
+        n = len(self.cars)
+        self.cars += [None] * n
+        self.distance = np.concatenate([self.distance, np.zeros_like(self.distance)])
+        self.owners = np.concatenate([self.owners, np.zeros_like(self.owners)])
+        self.free = list(range(2 * n - 1, n - 1, -1))
+
+    def buy(self, region, distance, old, new):
+        # A consumer of region, driving distance, replaces car old (None if first purchase) by car new
+        r = self.region_index[region]
+        if old is not None:
+            s = self.slots[old]
+            self.distance[s, r] -= distance
+            self.owners[s] -= 1
+            self.vacate([s])
+        s = self.slot(new)
+        self.distance[s, r] += distance
+        self.owners[s] += 1
+
+    def buy_many(self, regions, distances, old, new):
+        # Same as buy for arrays of consumers. regions are indices, old and new are slots, old is -1 if none
+        had = old >= 0
+        np.subtract.at(self.distance, (old[had], regions[had]), distances[had])
+        np.subtract.at(self.owners, old[had], 1)
+        np.add.at(self.distance, (new, regions), distances)
+        np.add.at(self.owners, new, 1)
+        self.vacate(np.unique(old[had]).tolist())
+
+    def vacate(self, slots):
+        # Slots of cars nobody owns any longer are cleared, with no rounding left over, and freed
+        for s in slots:
+            if not self.owners[s]:
+                self.distance[s] = 0
+                del self.slots[self.cars[s]]
+                self.cars[s] = None
+                self.free.append(s)
+
+    def car_emissions(self):
+        # Emissions of a unit of distance of each slot, 0 for empty ones
+        return np.array([car.emissions() if car is not None else 0 for car in self.cars])
+
+    def emissions(self):
+        # Total emissions of a tick: distance driven with each car times its emissions
+        return float(self.distance.sum(axis=1) @ self.car_emissions())
+
+    def by_region(self):
+        return dict(zip(self.regions, (self.distance.T @ self.car_emissions()).tolist()))
+
+    def by_firm(self):
+        out = dict()
+        for car, e in zip(self.cars, (self.distance.sum(axis=1) * self.car_emissions()).tolist()):
+            if car is not None:
+                out[car.firm.id] = out.get(car.firm.id, 0) + e
+        return out
@@ -0,0 +1,94 @@
+""" Global sensitivity analysis: all parameters vary at once over a space-filling design.
+    Sobol indices come from a Saltelli design, at n * (k + 2) points for k parameters.
+    Ranges follow main.py: {param: {'min': ..., 'max': ..., '_type': 'i' or 'f'}}
+"""
+from collections import defaultdict
+
+import numpy as np
+
+import sweep
+from aggregate import OnlineStats
+
+
+def latin_hypercube(n, k, rng):
+    # n points in the unit cube, exactly one in each of the n strata of every dimension
+    u = (rng.random((n, k)) + np.arange(n)[:, None]) / n
+    return np.take_along_axis(u, rng.random((n, k)).argsort(axis=0), axis=0)
+
+
+def scale(u, ranges):
+    # From the unit cube to parameter values. Integer parameters take each whole value in [min, max] equally often
+    points = list()
+    for row in u:
+        point = list()
+        for x, r in zip(row, ranges.values()):
+            if r.get('_type') == 'i':
+                point.append(int(min(r['min'] + np.floor(x * (r['max'] - r['min'] + 1)), r['max'])))
+            else:
+                point.append(float(f"{r['min'] + x * (r['max'] - r['min']):.4f}"))
+        points.append(tuple(point))
+    return points
+
+
+class Sobol:
+    """ Saltelli design over ranges: matrices A and B, two Latin hypercubes of n points each, and for every parameter
+        i, A with column i taken from B. First-order indices by the Saltelli (2010) estimator, total indices by the
+        Jansen (1999) one
+    """
+
+    def __init__(self, ranges, n, seed=0):
+        self.names = tuple(ranges)
+        self.n = n
+        k = len(self.names)
+        rng = np.random.default_rng(seed)
+        a, b = latin_hypercube(n, k, rng), latin_hypercube(n, k, rng)
+        blocks = [a, b]
+        for i in range(k):
+            ab = a.copy()
+            ab[:, i] = b[:, i]
+            blocks.append(ab)
+        self.points = scale(np.concatenate(blocks), ranges)
+
+    def __len__(self):
+        return len(self.points)
+
+    def tasks(self, pol=None, level=0.0, replicates=1):
+        # Each point carries all its parameters. See sweep.grid. Points repeated in the design run once
+        return [(pol, level, i, self.names, point) for point in dict.fromkeys(self.points)
+                for i in range(replicates)]
+
+    def indices(self, y, resamples=200, seed=0):
+        """ y: (points, outputs), the output at each point of the design, in order.
+            Returns first-order (S1) and total (ST) indices, (parameters, outputs), with bootstrap standard errors
+        """
+        k = len(self.names)
+        y = np.asarray(y, dtype=float).reshape((k + 2, self.n, -1))
+
+        def estimate(rows):
+            fa, fb, fab = y[0, rows], y[1, rows], y[2:, rows]
+            var = np.var(np.concatenate([fa, fb]), axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.mean(fb * (fab - fa), axis=1) / var, .5 * np.mean((fa - fab) ** 2, axis=1) / var
+
+        s1, st = estimate(np.arange(self.n))
+        rng = np.random.default_rng(seed)
+        boot = [estimate(rng.integers(0, self.n, self.n)) for _ in range(resamples)]
+        return {'S1': s1, 'ST': st,
+                'S1_se': np.nanstd([b[0] for b in boot], axis=0), 'ST_se': np.nanstd([b[1] for b in boot], axis=0)}
+
+
+def run(design, pol=None, level=0.0, replicates=1, n_jobs=1, **kwargs):
+    """ Runs every point of the design, replicates times, on one pool (see sweep.execute), and computes the indices
+        of the mean of each of the metrics given at the last tick. Returns {metric: {param: {'S1', 'ST', 'S1_se',
+        'ST_se'}}}
+    """
+    metrics = kwargs['metrics']
+    # Replicates of a point are averaged
+    stats = defaultdict(lambda: OnlineStats((len(metrics), )))
+    for task, result in sweep.execute(design.tasks(pol, level, replicates), n_jobs, **kwargs):
+        stats[task[4]].update(result.values[-1])
+    y = np.array([stats[point].mean for point in design.points])
+    out = design.indices(y)
+    # Metrics that do not vary, or are never written, have no indices: None
+    return {m: {name: {k: float(v[i, j]) if np.isfinite(v[i, j]) else None for k, v in out.items()}
+                for i, name in enumerate(design.names)} for j, m in enumerate(metrics)}
@@ -0,0 +1,44 @@
+import numpy as np
+
+# Positions of the technologies in the arrays. Same order as the firms' dicts always had:
+# Simulation.apply_policies reads sold cars in this order
+TECHS = {'gas': 0, 'hybrid': 1, 'green': 2}
+# market_share has a fourth slot, the firm's total
+SHARES = {**TECHS, 'total': 3}
+
+
+class Ledger:
+    """ Time series of all firms, owned by the Simulation: profit, investments and sold cars, shape (rows, techs,
+        T + 1), and market shares, shape (rows, techs + total, T + 1). Each firm holds its row.
+        Column T is never written, so that t - 1 at t = 0 reads 0, as the defaultdicts the firms kept did.
+        Rows of firms gone bankrupt are cleared and given to new firms. Rows double when all are taken
+    """
+
+    def __init__(self, periods, rows=32):
+        self.periods = periods
+        self.profit = np.zeros((rows, len(TECHS), periods + 1))
+        self.investments = np.zeros((rows, len(TECHS), periods + 1))
+        self.sold_cars = np.zeros((rows, len(TECHS), periods + 1), dtype=np.int64)
+        self.market_share = np.zeros((rows, len(SHARES), periods + 1))
+        # Lowest free row last, so it is taken first
+        self.free = list(range(rows - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.profit)
+
+    def take(self):
+        if not self.free:
+            self.grow()
+        return self.free.pop()
+
+    def release(self, row):
+        for values in (self.profit, self.investments, self.sold_cars, self.market_share):
+            values[row] = 0
+        self.free.append(row)
+
+    def grow(self):
+        n = len(self)
+        for name in ('profit', 'investments', 'sold_cars', 'market_share'):
+            values = getattr(self, name)
+            setattr(self, name, np.concatenate([values, np.zeros_like(values)]))
+        self.free = list(range(2 * n - 1, n - 1, -1))
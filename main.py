@@ -5,10 +5,15 @@ import time
 
 import matplotlib.pyplot as plt
 import pandas as pd
-from joblib import Parallel, delayed
 from numpy import linspace
 
-import model
+import gsa
+import params
+import profiler
+import sweep
+from aggregate import Aggregator
+from cache import RunCache
+from store import ResultStore
 
 # 1. Emissions index
 # 2. Green market-share
@@ -37,6 +42,23 @@ policies_titles = {None: ['Base de comparação', 'black'],
                    'p_d': ['Retorno de investimentos em P&D', 'green']}
 verbose = False
 seed = False
+# Root of the seed streams of a sweep: each run gets its own, reproducible one. None falls back to 'seed' above
+root_seed = 20210802
+# Common random numbers: replicate i of every policy arm shares its random streams (needs root_seed).
+# Then ratios to the baseline are computed run by run and plotted with their own confidence bands
+crn = False
+# Adaptive replication: instead of n runs everywhere, stop each (policy, level) once the 95% confidence interval
+# half width of these metrics is within tolerance. E.g. {'tolerance': {'green_market_share': .005,
+# 'emissions_index': .005}, 'min_runs': 50, 'max_runs': 2000, 'batch': 50}. None runs n replicates of each
+adaptive = None
+# Finished runs are kept on disk and skipped when a sweep is run again. None disables it
+cache = RunCache('cache', max_bytes=2 * 1024 ** 3)
+# What each worker sends back: metrics (None for all) at the selected ticks
+metrics = None
+ticks = [params.T - 1]
+levels = [round(lev, 1) for lev in linspace(0, 1, 10)]
+# pols = [None, 'tax', 'p_d', 'e_max']
+pols = [None, 'tax', 'p_d']
 
 
 def processing_averages(pol_results):
@@ -69,27 +91,38 @@ def plot_details(ax):
 
 
 def plot_policies(results, levels, n):
-    # Receives a dictionary of results for policies
+    # Receives an Aggregator of results for policies
     # Each with all 9 levels
-    # Each witn an 'n' number of runs
-    # Inside each run, a DataFrame with reported results
+    # Each witn an 'n' number of runs, or (fewest, most) runs of any scenario under adaptive replication
+    # Means and confidence bands of the reported results were accumulated as runs finished
+    if isinstance(n, tuple):
+        n = n[0] if n[0] == n[1] else f'{n[0]} to {n[1]}'
     for graph in notes:
         fig, ax = plt.subplots()
         benchmark_values = list()
         for pol in policies_titles:
-            x_s, y_s = list(), list()
+            x_s, y_s, lows, highs = list(), list(), list(), list()
             for i, level in enumerate(levels):
                 x_s.append(level)
                 # Calculate values for graph relative to benchmark and add to list
-                y_output = sum([results[pol][level][key].loc[graph] for key in results[pol][level]]) / n
+                y_output = results.mean(pol, level, graph)
+                low, high = results.band(pol, level, graph)
                 if pol is None:
                     benchmark_values.append(y_output)
+                elif results.paired is not None:
+                    # Common random numbers: mean of the run by run ratios to the baseline
+                    y_output, low, high = results.ratio(pol, level, graph)
                 else:
-                    y_output = y_output/benchmark_values[i] if benchmark_values[i] != 0 else 0
+                    scale = benchmark_values[i] if benchmark_values[i] != 0 else 0
+                    y_output, low, high = (v / scale if scale else 0 for v in (y_output, low, high))
                 y_s.append(y_output)
+                lows.append(low)
+                highs.append(high)
             # Plot each policy line
             if pol is None:
                 y_s = [b / b if b != 0 else 1 for b in benchmark_values]
+            else:
+                ax.fill_between(x_s, lows, highs, color=policies_titles[pol][1], alpha=.15, lw=0)
             ax.plot(x_s, y_s, label=policies_titles[pol][0], color=policies_titles[pol][1])
         # Finish touches
         ax.legend(frameon=False)
@@ -102,64 +135,86 @@ def plot_policies(results, levels, n):
     return results
 
 
-def policies(path, timestamp, n=10, n_jobs=1, save=None, param=None, value=None):
-    levels = [round(lev, 1) for lev in linspace(0, 1, 10)]
-    # pols = [None, 'tax', 'p_d', 'e_max']
-    pols = [None, 'tax', 'p_d']
+def options(save, param=None, value=None):
+    return dict(verbose=verbose, seed=seed, param=param, value=value, metrics=metrics, ticks=ticks,
+                full=bool(save), root=root_seed, crn=crn, cache=cache)
+
 
+def policies(path, timestamp, n=10, n_jobs=1, save=None, param=None, value=None):
     if not os.path.exists(path):
         os.mkdir(path)
-    fullpath = os.path.join(path, timestamp)
+    # Full reports of all runs go to a single columnar store. See store.py
+    store = ResultStore(os.path.join(path, timestamp)) if save else None
+
+    # Mean, variance and quantiles of each (policy, level) are updated as each run arrives. Runs are not kept
+    results = Aggregator(metrics, ticks, paired=pols if crn else None)
+    # The whole grid of policies, levels and repetitions runs on one pool. Results arrive as runs finish
+    if adaptive:
+        print(f'Running {len(pols)} policies x {len(levels)} levels, adaptive replication')
+        runs = sweep.adaptive([(pol, level) for pol in pols for level in levels], n_jobs=n_jobs,
+                              stop=results.stop, **adaptive, **options(save, param, value))
+    else:
+        print(f'Running {len(pols)} policies x {len(levels)} levels x {n} runs')
+        runs = sweep.execute(sweep.grid(pols, levels, n), n_jobs, **options(save, param, value))
+    for (pol, level, i), s in runs:
+        results.add((pol, level, i), s)
+        if save:
+            store.append((pol, level, i), s)
     if save:
-        os.mkdir(fullpath)
-
-    # A dictionary of general results
-    results = dict()
-    for pol in pols:
-        # A dictionary for each policy results
-        results[pol] = dict()
-        # Run for all levels specified
-        for level in levels:
-            p = {'policy': pol, 'level': level}
-            # For each run policy, when dictionary with all runs is saved.
-            # Thus, result collected is a dictionary of dictionaries containing DataFrames
-            results[pol][level] = dict()
-            # Run in parallel is the number of repetitions per level
-            with Parallel(n_jobs=n_jobs) as parallel:
-                print(f'Running {pol}: {level}')
-                s = parallel(delayed(model.main)(p, verbose, seed, param, value) for i in range(n))
-                for i in range(n):
-                    results[pol][level][i] = s[i].report.loc[39]
-                    if save:
-                        s[i].report.to_csv(f'{fullpath}/{pol}_{level}_{i}.csv', sep=';', index=False)
-
-            # for i in range(n):
-            #     s = model.main(p, verbose, seed=seed)
-            #     results[pol][level][i] = s.report.loc[39]
-    return results, levels, n
+        store.flush()
+    if results.profiles:
+        print(profiler.summary(results.profile()))
+    # Adaptive scenarios stop anywhere between min_runs and max_runs: the counts actually run
+    return results, levels, results.runs() if adaptive else n
 
 
 def save_results_as_json(path, results):
     if not os.path.exists(path):
         os.mkdir(path)
     timestamp = datetime.datetime.utcnow().isoformat().replace(':', '_')
+    # Numbers stay numbers: statistics by policy, level, tick and metric
     with open(os.path.join(path, f'{timestamp}.json'), 'w') as f:
-        json.dump(results, f, default=str)
+        json.dump(results.to_dict(), f, allow_nan=False)
 
 
 def sensitivity(parameter, min_value, max_value, n_intervals, _type, path, timestamp, n=10, n_jobs=1, save=None):
-    values = linspace(min_value, max_value, n_intervals)
-
-    for value in values:
-        if _type == 'i':
-            value = int(value)
-        else:
-            value = f'{value:.4f}'
-            value = float(value)
-        new_path = os.path.join(path, f'{parameter}={value}')
+    values = [int(v) if _type == 'i' else float(f'{v:.4f}') for v in linspace(min_value, max_value, n_intervals)]
+    paths = {value: os.path.join(path, f'{parameter}={value}') for value in values}
+    for new_path in paths.values():
         if not os.path.exists(new_path):
             os.makedirs(new_path)
-        policies(new_path, timestamp, n, n_jobs, save, parameter, value)
+    if adaptive:
+        # Stopping rules are per scenario, one value after the other
+        return {value: policies(paths[value], timestamp, n, n_jobs, save, parameter, value)[0] for value in values}
+
+    # Each task carries its own parameters: all values share one pool, results are routed back by value
+    results = {value: Aggregator(metrics, ticks, paired=pols if crn else None) for value in values}
+    stores = {value: ResultStore(os.path.join(paths[value], timestamp)) for value in values} if save else None
+    print(f'Running {parameter} x {len(values)} values x {len(pols)} policies x {len(levels)} levels x {n} runs')
+    for task, s in sweep.execute(sweep.grid(pols, levels, n, parameter, values), n_jobs, **options(save)):
+        value = task[4]
+        results[value].add(task, s)
+        if save:
+            stores[value].append(task, s)
+    if save:
+        for store in stores.values():
+            store.flush()
+    return results
+
+
+def global_sensitivity(ranges, n, replicates, path, timestamp, n_jobs=1, pol=None, level=0.0):
+    """ All parameters in ranges vary together over a Saltelli design of n base points (see gsa.py):
+        n * (len(ranges) + 2) points, instead of a policy grid for each value of each parameter
+    """
+    design = gsa.Sobol(ranges, n, seed=root_seed or 0)
+    names = list(notes) if metrics is None else metrics
+    print(f'Running {len(ranges)} parameters x {len(design)} points x {replicates} runs')
+    indices = gsa.run(design, pol, level, replicates, n_jobs, **dict(options(False), metrics=names))
+    if not os.path.exists(path):
+        os.mkdir(path)
+    with open(os.path.join(path, f'sobol_{timestamp}.json'), 'w') as f:
+        json.dump(indices, f, allow_nan=False)
+    return indices
 
 
 # def plotting(results, n):
@@ -220,6 +275,9 @@ if __name__ == '__main__':
     #                 paramaters_to_test[param]['_type'],
     #                 p, t, m, cpus, save_data)
 
+    # IF GLOBAL SENSITIVITY OF ALL PARAMETERS AT ONCE, UNCHECK THE NEXT LINE
+    # global_sensitivity(paramaters_to_test, 64, 10, p, t, cpus)
+
     # IF SENSITIVITY, UNCHECK THE NEXT LINE
     # sensitivity('number_characteristics', 2, 5, 4, 'i', p, t, m, cpus, save_data)
 
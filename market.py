@@ -0,0 +1,70 @@
+import bisect
+
+import numpy as np
+
+from ledger import SHARES
+
+# Criteria consumers may use to evaluate cars. 'emotion' is drawn by the consumer, all others come from the offer
+CRITERIA = ['car_affordability', 'use_affordability', 'stations', 'market_share',
+            'energy_capacity', 'car_cleanness', 'quality', 'emotion']
+COLUMNS = {c: i for i, c in enumerate(CRITERIA[:-1])}
+
+
+class OfferTable:
+    """ Cars on offer at time t, with every criterion value already computed for each consumer region.
+        Built once per tick, after policies have set prices. Nothing in it changes during the demand phase
+    """
+
+    def __init__(self, sim):
+        self.t = sim.t
+        self.regions = list(sim.params.regions_consumers.keys())
+        self.region_index = {r: j for j, r in enumerate(self.regions)}
+        self.cars = [car for firm in sim.firms.values() for car in firm.cars.values()]
+        self.rows = {car: i for i, car in enumerate(self.cars)}
+        self.price = np.array([car.sales_price for car in self.cars], dtype=float)
+        self.drive_range = np.array([car.drive_range() for car in self.cars], dtype=float)
+        self.emissions = np.array([car.emissions() for car in self.cars], dtype=float)
+        # Shape (cars, consumer regions, criteria but emotion)
+        self.values = np.empty((len(self.cars), len(self.regions), len(COLUMNS)))
+        icms = np.array([sim.params.icms[r] for r in self.regions])
+        rows = [car.firm.row for car in self.cars]
+        techs = [SHARES[car.type] for car in self.cars]
+        market_share = np.maximum(sim.ledger.market_share[rows, techs, sim.t], sim.params.epsilon)
+        for i, car in enumerate(self.cars):
+            # Included FREIGHT from firm region to consumer region!
+            # Included ICMS charged on DESTIN. That is, the region of the CONSUMER
+            freight = np.array([sim.params.freight[car.firm.region][r] for r in self.regions])
+            self.values[i, :, COLUMNS['car_affordability']] = 1 / ((car.sales_price * (1 + icms)) + freight)
+            self.values[i, :, COLUMNS['use_affordability']] = [1 / sim.params.price_energy[r][car.type]
+                                                               for r in self.regions]
+            self.values[i, :, COLUMNS['stations']] = sim.green_stations[sim.t] if car.type == 'green' \
+                else sim.params.stations['gas']
+            self.values[i, :, COLUMNS['market_share']] = market_share[i]
+            self.values[i, :, COLUMNS['energy_capacity']] = car.EC
+            self.values[i, :, COLUMNS['car_cleanness']] = 1 / self.emissions[i]
+            self.values[i, :, COLUMNS['quality']] = car.QL
+        # Market index: cars within regulation (e_max is already set for this tick), sorted by sales price.
+        # Affordable cars are then a prefix of the index
+        allowed = np.flatnonzero(self.emissions < sim.e_max)
+        self.order = allowed[np.argsort(self.price[allowed], kind='stable')]
+        self.sorted_price = self.price[self.order]
+        self._order = self.order.tolist()
+        self._sorted_price = self.sorted_price.tolist()
+        self._drive_range = self.drive_range.tolist()
+
+    def __len__(self):
+        return len(self.cars)
+
+    def market(self, price_max, dk):
+        # Affordable cars, within needed range and within regulation. Kept in offer order
+        k = bisect.bisect_left(self._sorted_price, price_max)
+        rows = sorted(i for i in self._order[:k] if self._drive_range[i] > dk)
+        return [self.cars[i] for i in rows]
+
+    def score(self, car, region, emotion, criteria):
+        # Product of the selected criteria only
+        values = self.values[self.rows[car], self.region_index[region]]
+        res = 1
+        for c in criteria:
+            res *= emotion if c == 'emotion' else values[COLUMNS[c]]
+        return res
@@ -4,11 +4,23 @@ import time
 from collections import defaultdict
 
 import numpy as np
-import pandas as pd
 
 from cars import Vehicle
 from consumers import Consumer
+from demand import Population
+from events import Tracer
 from firms import Firm
+from fleet import Fleet
+from ledger import SHARES, TECHS, Ledger
+from market import OfferTable
+from parameters import override
+from profiler import NullProfiler, Profiler
+from registry import FirmRegistry, weighted_choice
+from report import Report, RunResult
+from supply import Supply
+
+# Draw sites: consumer creation, firm budgets, purchases, R&D and portfolio adoption
+SITES = ['agents', 'budget', 'purchase', 'invest', 'portfolio']
 
 # Sequence
 """
@@ -21,8 +33,7 @@ from firms import Firm
 
 class Simulation:
 
-    def __init__(self, policy=None, verbose=False, seed=True, param=None, value=None):
-        import params
+    def __init__(self, policy=None, verbose=False, seed=True, param=None, value=None, params=None):
         self.log = logging.getLogger('main')
         if verbose:
             logging.basicConfig(level=logging.INFO)
@@ -30,14 +41,29 @@ class Simulation:
         else:
             self.log.setLevel(30)
             self.sleep = False
-        if not seed:
+        if seed is True:
+            self.seed = random.Random(0)
+        elif seed is False or seed is None:
             self.seed = random.Random()
         else:
-            self.seed = random.Random(0)
+            # An int or a numpy SeedSequence: a reproducible stream of its own for this run
+            self.seed = random.Random(seed if isinstance(seed, int) else
+                                      int.from_bytes(seed.generate_state(4).tobytes(), 'little'))
+        # Draw sites with a stream of their own. With a SeedSequence each site gets an independent child, so that
+        # runs given the same sequence (common random numbers) draw the same numbers at the same sites.
+        # Otherwise all sites share self.seed, as they always did
+        if isinstance(seed, np.random.SeedSequence):
+            self.streams = {site: random.Random(int.from_bytes(
+                np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (j, )).generate_state(4).tobytes(),
+                'little')) for j, site in enumerate(SITES)}
+        else:
+            self.streams = dict.fromkeys(SITES, self.seed)
         self.t = 0
-        self.params = params
-        if param:
-            self.params.__dict__[param] = value
+        # Parameters are immutable. A sensitivity override builds a set of its own, nothing global is changed
+        self.params = params if params is not None else override(param, value)
+        self.profiler = Profiler() if self.params.profile else NullProfiler()
+        # Structured events (see events.py). None when off: every call site checks it first. Verbose runs print them
+        self.trace = Tracer(self.log if verbose else None) if verbose or self.params.trace else None
         # Benchmark e policy parameter: average emission sold vehicles
         self.e = 1
         # When e_max policy is not being tested, all cars will pass
@@ -45,10 +71,17 @@ class Simulation:
         self.policy = policy
         self.ids = 0
         self.running = True
-        self.firms = dict()
-        self.new_firms = list()
+        # Firms by id, indexed by region, technology held and entrants
+        self.firms = FirmRegistry(self.params.regions_firms, TECHS)
         self.consumers = dict()
+        self.population = None
+        self.offers = None
+        # Distance driven with each car, kept up to date at each purchase. See driving
+        self.fleet = Fleet(self.params.regions_consumers)
+        # Time series of all firms, one row each. Room for twice the initial firms before it grows
+        self.ledger = Ledger(self.params.T, 2 * sum(self.params.regions_firms.values()))
         self.create_agents()
+        self.supply = Supply(self) if self.params.supply_engine == 'vectorized' else None
         self.green_market_share = dict()
         self.green_stations = dict()
 
@@ -56,18 +89,29 @@ class Simulation:
                          'hybrid': defaultdict(int),
                          'gas': defaultdict(int)}
         self.emissions = 0
-        # 'emissions' is total value, 'emissions_index' is relative to first month emissions
-        # 'e' is the calculated parameter benchmark, based on sold vehicles and their energy economy
-        self.report = pd.DataFrame(columns=['green_market_share', 'hybrid_market_share', 'new_firms_share',
-                                            'emissions', 'emissions_index', 'e',
-                                            'public', 'public_index', 'public_cumulative'])
+        self.public_cumulative = 0
+        self.public_base = 0
+        # Indicators are written into a preallocated buffer. See report.py
+        self.records = Report(self.params.T, ['se', 's', 'ne', 'n', 'co'])
+
+    @property
+    def report(self):
+        # DataFrame view of the indicators up to the current t
+        return self.records.frame(min(self.t + 1, self.params.T))
 
     def create_agents(self):
         for key in self.params.regions_firms:
             for i in range(self.params.regions_firms[key]):
                 self.firms[self.ids] = Firm(self.ids, key, self)
                 self.ids += 1
-        regions = self.seed.choices(population=list(self.params.regions_consumers.keys()),
+        if self.params.demand_engine == 'vectorized':
+            self.population = Population(self)
+            self.ids += len(self.population)
+            self.log.info(self.params.cor.Fore.MAGENTA + f"We have created {len(self.firms)} firms "
+                                                         f"and {len(self.population)} agents, being "
+                                                         f"{self.population.count('se')} of them from SE")
+            return
+        regions = self.streams['agents'].choices(population=list(self.params.regions_consumers.keys()),
                                     k=self.params.num_consumers, weights=self.params.regions_consumers.values())
         for j in range(self.params.num_consumers):
             self.consumers[self.ids] = Consumer(self.ids, regions[j], self)
@@ -88,15 +132,16 @@ class Simulation:
                 sleep = 1
                 time.sleep(sleep)
                 self.log.info(self.params.cor.Fore.MAGENTA + f'Time: {self.t} -- deliberate pausing for {sleep} seconds')
-        self.log.info(self.params.cor.Fore.RED + f"Total emissions for this run was {sum(self.report['emissions']):,.2f}")
+        self.log.info(self.params.cor.Fore.RED + f"Total emissions for this run was "
+                                                 f"{np.nansum(self.records.column('emissions')):,.2f}")
 
     def update_car_info(self, car_type):
         self.num_cars[car_type][self.t] += 1
 
     def new_firm(self, busted):
         # 1. Pick an existing firm, proportional to market share
-        weights = [f.market_share['total'][self.t] for f in self.firms.values()]
-        key = self.seed.choices(list(self.firms.values()), weights=weights)
+        key = [weighted_choice(self.seed, list(self.firms.values()),
+                               self.firms.cumulative(self.ledger, SHARES['total'], self.t))]
         while True:
             # Making sure firm to imitate has not just gone busted
             try:
@@ -117,7 +162,7 @@ class Simulation:
             if choice < 1/6:
                 techs = ['gas', 'green', 'hybrid']
             elif choice < 1/2:
-                techs = self.seed.sample(firm_to_imitate.cars.keys(), k=2)
+                techs = self.seed.sample(list(firm_to_imitate.cars.keys()), k=2)
             else:
                 techs = [self.seed.choice(list(firm_to_imitate.cars.keys()))]
         else:
@@ -125,8 +170,9 @@ class Simulation:
         # Create new firm, without a car at first, then follow decision on techs
         # Budget is random
         new_firm = Firm(self.ids, firm_to_imitate.region, self, gas=False)
-        self.log.info(f'New firm {new_firm.id} created')
-        self.new_firms.append(new_firm.id)
+        if self.trace:
+            self.trace('new_firm', self.t, new_firm.id)
+        self.firms.enter(new_firm)
         self.ids += 1
         # Add portfolio
         for i in techs:
@@ -136,6 +182,9 @@ class Simulation:
                           self.seed.uniform(self.params.energy_economy[i], firm_to_imitate.cars[i].EE))
             new_firm.cars[i] = Vehicle(firm=new_firm, _type=i, production_cost=pc, ec=ec, ee=ee)
             new_firm.portfolio_marker = self.t
+        if new_firm.id not in self.firms:
+            # The new firm is not registered in self.firms, as in published runs. Nothing reads its row again
+            self.ledger.release(new_firm.row)
 
     def update_green_market_and_stations(self):
         # Update green market share
@@ -150,50 +199,57 @@ class Simulation:
             self.green_market_share[self.t] = green_cars / total_cars if total_cars > 0 else 0
             # Update green stations
             self.green_stations[self.t] = 1 + max(self.green_market_share.values())
-        self.report.loc[self.t, 'green_market_share'] = self.green_market_share[self.t]
+        self.records[self.t, 'green_market_share'] = self.green_market_share[self.t]
 
     def apply_policies(self):
         # e (e_benchmark) is the average emission of vehicles sold in the previous period
         # Calculate e
         if self.t > 0:
             cars_emission = [car.emissions() for firm in self.firms.values() for car in firm.cars.values()]
-            sold = [sold[self.t - 1] for firm in self.firms.values() for sold in firm.sold_cars.values()]
+            sold = self.ledger.sold_cars[[firm.row for firm in self.firms.values()], :, self.t - 1].ravel().tolist()
             # Notice, sometimes no cars are sold (market conditions or policies are too restrict)
             sold_cars_emissions = sum([c * sd for c, sd in zip(cars_emission, sold)])/sum(sold) if sum(sold) > 0 else 0
             self.e = sold_cars_emissions
-            self.report.loc[self.t, 'e'] = self.e
-            self.log.info(f'Parameter e -- sold cars emission average -- is {sold_cars_emissions:.4f}')
+            self.records[self.t, 'e'] = self.e
+            if self.trace:
+                self.trace('e', self.t, value=sold_cars_emissions)
             if self.policy['policy'] == 'e_max':
                 self.e_max = self.e * (1 + self.params.e_max[self.policy['level']])
-                self.log.info(f'Max emission for time {self.t} is {self.e_max:.2f}')
+                if self.trace:
+                    self.trace('e_max', self.t, value=self.e_max)
             # When updating car prices, if policy is in effect, DISCOUNTS AND TAXES are summed and returned
             public_expenditure = defaultdict(float)
             for r in ['se', 's', 'ne', 'n', 'co']:
-                for firm in self.firms.values():
-                    if firm.region == r:
-                        for car in firm.cars.values():
-                            temp_debt = sum([car.calculate_price() * firm.sold_cars[car.type][self.t - 1]])
-                            # Checking criteria to enter policy tax deduction when in effect.
-                            if (car.type == 'green' or car.type == 'hybrid') and self.policy['policy'] == 'p_d':
-                                # Deducing up to 12.5% of the investment made by the firm on that car
-                                max_possible_deduction = firm.investments[car.type][self.t - 1] * self.policy['level']
-                                cashback = min(temp_debt, max_possible_deduction)
-                                public_expenditure[r] += temp_debt - cashback
-                                firm.budget += cashback
-                            else:
-                                public_expenditure[r] += temp_debt
+                for firm in self.firms.by_region[r].values():
+                    for car in firm.cars.values():
+                        temp_debt = sum([car.calculate_price() *
+                                         self.ledger.sold_cars[firm.row, TECHS[car.type], self.t - 1]])
+                        # Checking criteria to enter policy tax deduction when in effect.
+                        if (car.type == 'green' or car.type == 'hybrid') and self.policy['policy'] == 'p_d':
+                            # Deducing up to 12.5% of the investment made by the firm on that car
+                            max_possible_deduction = self.ledger.investments[firm.row, TECHS[car.type], self.t - 1] * \
+                                self.policy['level']
+                            cashback = min(temp_debt, max_possible_deduction)
+                            public_expenditure[r] += temp_debt - cashback
+                            firm.budget += cashback
+                        else:
+                            public_expenditure[r] += temp_debt
                 # Registering all public investment on the region
-                self.report.loc[self.t, 'public' + '_' + r] = public_expenditure[r]
+                self.records[self.t, 'public' + '_' + r] = public_expenditure[r]
             # All regions together
-            self.report.loc[self.t, 'public'] = sum(public_expenditure.values())
-            base = [b for b in self.report.public if (not np.isnan(b)) and (b != 0)]
-            self.report.loc[self.t, 'public_cumulative'] = sum(base)
-            if not base:
-                self.report.loc[self.t, 'public_index'] = 0
+            public = sum(public_expenditure.values())
+            self.records[self.t, 'public'] = public
+            # Running accumulators. Base of the index is the first non-zero public expenditure
+            self.public_cumulative += public
+            if not self.public_base:
+                self.public_base = public
+            self.records[self.t, 'public_cumulative'] = self.public_cumulative
+            if not self.public_base:
+                self.records[self.t, 'public_index'] = 0
             else:
-                self.report.loc[self.t, 'public_index'] = sum(public_expenditure.values()) / base[0]
-            self.log.info(self.params.cor.Fore.RED + f"Government has paid/received total at this t {self.t} "
-                                                f"a net total of $ {sum(public_expenditure.values()):,.2f}")
+                self.records[self.t, 'public_index'] = public / self.public_base
+            if self.trace:
+                self.trace('public', self.t, value=public)
 
     def run(self):
         """
@@ -210,46 +266,71 @@ class Simulation:
         5. Choose car
         6. Update market share
         """
-        self.offer()
-        self.apply_policies()
-        self.demand()
-        self.driving()
+        profiler = self.profiler
+        with profiler.phase('offer'):
+            self.offer()
+        with profiler.phase('apply_policies'):
+            self.apply_policies()
+        # Prices and firms are settled for this tick. Consumers share one table of offers
+        with profiler.phase('offers'):
+            self.offers = OfferTable(self)
+        with profiler.phase('demand'):
+            self.demand()
+        with profiler.phase('driving'):
+            self.driving()
 
     def offer(self):
         self.update_green_market_and_stations()
-        landfill = list()
         # Randomize order of firms at each turn
         keys = list(self.firms)
         self.seed.shuffle(keys)
 
         total_cars_sold = sum([self.num_cars[tech][self.t - 1] for tech in ['gas', 'green', 'hybrid']])
+        if self.supply is not None:
+            landfill = self.supply.offer(self, keys, total_cars_sold)
+        else:
+            landfill = self.offer_firms(keys, total_cars_sold)
+        self.profiler.count('bankruptcies', len(landfill))
+
+        # New firms market share
+        new = [f.row for f in self.firms.entrants.values()]
+        self.records[self.t, 'new_firms_share'] = self.ledger.market_share[new, SHARES['total'], self.t].sum()
+
+        if self.trace:
+            for i in landfill:
+                self.trace('bankruptcy', self.t, i)
+        for i in landfill:
+            self.new_firm(landfill)
+            # Its row goes to the next new firm
+            self.ledger.release(self.firms[i].row)
+            del self.firms[i]
+
+    def offer_firms(self, keys, total_cars_sold):
+        # Each firm in turn. Returns the firms gone bankrupt
+        landfill = list()
+        profiler = self.profiler
         for key in keys:
-            self.firms[key].update_profit()
-            self.firms[key].update_market_share(total_cars_sold)
-            self.firms[key].update_budget()
+            with profiler.phase('offer.firms'):
+                self.firms[key].update_profit()
+                self.firms[key].update_market_share(total_cars_sold)
+                self.firms[key].update_budget()
             if self.firms[key].bankrupt():
                 landfill.append(key)
                 # If bankrupt, go to the next firm
                 continue
             if self.t > 9:
                 # If portfolio is changed, costs of adoption apply
-                self.firms[key].change_portfolio()
-                self.firms[key].abandon_portfolio()
-            self.firms[key].invest_rd()
-
-        # New firms market share
-        self.report.loc[self.t, 'new_firms_share'] = sum([f.market_share['total'][self.t]
-                                                          for f in self.firms.values()
-                                                          if f.id in self.new_firms])
-
-        if landfill:
-            self.log.info(self.params.cor.Fore.LIGHTMAGENTA_EX + f'Firms {[i for i in landfill]} '
-                                                    f'has(ve) gone bankrupt at time {self.t}')
-        for i in landfill:
-            self.new_firm(landfill)
-            del self.firms[i]
+                with profiler.phase('offer.portfolio'):
+                    self.firms[key].change_portfolio()
+                    self.firms[key].abandon_portfolio()
+            with profiler.phase('offer.invest'):
+                self.firms[key].invest_rd()
+        return landfill
 
     def demand(self):
+        if self.population is not None:
+            self.population.purchase(self)
+            return
         # Randomize order of firms at each turn
         keys = list(self.consumers)
         self.seed.shuffle(keys)
@@ -257,22 +338,35 @@ class Simulation:
             self.consumers[key].purchase(self)
 
     def driving(self):
-        for each in self.consumers.values():
-            self.emissions += each.driving()
-        self.report.loc[self.t, 'emissions'] = self.emissions
+        # Sum over cars in use, not consumers. Per region and firm: self.fleet.by_region(), self.fleet.by_firm()
+        self.emissions += self.fleet.emissions()
+        self.records[self.t, 'emissions'] = self.emissions
         if self.t > 2:
-            self.report.loc[self.t, 'emissions_index'] = self.emissions / self.report.loc[3, 'emissions']
-        self.log.info(self.params.cor.Fore.RED + f"Emissions at t {self.t} was {self.emissions:,.2f}. "
-                                            f"Emissions index: {self.report.loc[self.t, 'emissions_index']:.4f}")
+            self.records[self.t, 'emissions_index'] = self.emissions / self.records[3, 'emissions']
+        if self.trace:
+            self.trace('emissions', self.t, value=self.emissions, extra=self.records[self.t, 'emissions_index'])
         self.emissions = 0
 
 
-def main(policy, verbose=False, seed=True, param=None, value=None):
-    my_sim = Simulation(policy, verbose, seed, param, value)
+def main(policy, verbose=False, seed=True, param=None, value=None, params=None):
+    my_sim = Simulation(policy, verbose, seed, param, value, params)
     my_sim.controller()
     return my_sim
 
 
+def run(policy, verbose=False, seed=True, param=None, value=None, metrics=None, ticks=None, full=False):
+    # Worker entry point. Returns a RunResult, not the Simulation with all its agents
+    my_sim = main(policy, verbose, seed, param, value)
+    result = RunResult(my_sim.records, policy, param, value, metrics, ticks, full)
+    result.profile = my_sim.profiler.to_dict()
+    if my_sim.trace:
+        result.events = my_sim.trace.arrays()
+    if isinstance(seed, np.random.SeedSequence):
+        # Enough to run it again on its own. See sweep.replay
+        result.stream = seed.entropy, seed.spawn_key
+    return result
+
+
 if __name__ == '__main__':
     level = 1.0
     # Three policies may be applied
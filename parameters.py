@@ -0,0 +1,77 @@
+""" Parameters of one simulation: params.py with overrides applied, immutable
+"""
+import hashlib
+import types
+
+import numpy as np
+
+import params
+
+# Tables derived from other parameters, in the order params.policy_tables returns them
+DERIVED = ['e_max', 'e_max_tax', 'tax', 'p_d']
+INPUTS = ['levels', 'e_max_max', 'e_max_min']
+
+
+def copy(value):
+    # Private copy, so that nothing done to the params module afterwards reaches these parameters
+    if isinstance(value, dict):
+        return {k: copy(v) for k, v in value.items()}
+    if isinstance(value, np.ndarray):
+        value = value.copy()
+        value.setflags(write=False)
+    return value
+
+
+class Parameters:
+    """ Immutable and hashable set of parameters, passed explicitly to each Simulation.
+        Built from the params module with overrides applied. Policy tables are rebuilt when their inputs change.
+        Functions and modules of params (discount_tax_table, cor) are reachable as well.
+        Values are plain attributes of the instance, read as fast as those of the module
+    """
+
+    def __init__(self, **overrides):
+        values = {k: v for k, v in vars(params).items()
+                  if not k.startswith('_') and not callable(v) and not isinstance(v, types.ModuleType)}
+        values.update(overrides)
+        if any(k in overrides for k in INPUTS):
+            values.update(zip(DERIVED, params.policy_tables(*(values[k] for k in INPUTS))))
+            # A table overridden on purpose is kept
+            values.update({k: v for k, v in overrides.items() if k in DERIVED})
+        digest = hashlib.sha256(repr(sorted(values.items())).encode()).hexdigest()
+        # Attributes are set through __dict__: __setattr__ refuses any change
+        self.__dict__.update({k: v for k, v in vars(params).items()
+                              if not k.startswith('_') and (callable(v) or isinstance(v, types.ModuleType))})
+        self.__dict__.update({k: copy(v) for k, v in values.items()})
+        self.__dict__.update(overrides=dict(overrides), digest=digest)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'Parameters are immutable. Build new ones: Parameters({name}=...)')
+
+    def __delattr__(self, name):
+        raise AttributeError('Parameters are immutable')
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __eq__(self, other):
+        return isinstance(other, Parameters) and self.digest == other.digest
+
+    def __reduce__(self):
+        # Only the overrides travel to worker processes. They rebuild the rest from params.py
+        return rebuild, (self.overrides, )
+
+    def __repr__(self):
+        return f'Parameters({", ".join(f"{k}={v!r}" for k, v in self.overrides.items())})'
+
+
+def rebuild(overrides):
+    return Parameters(**overrides)
+
+
+def override(param=None, value=None):
+    # Parameters of a sensitivity point: params.py with one parameter changed, or several given as tuples
+    if not param:
+        return Parameters()
+    if isinstance(param, tuple):
+        return Parameters(**dict(zip(param, value)))
+    return Parameters(**{param: value})
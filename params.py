@@ -13,6 +13,21 @@ num_consumers = 2000
 number_characteristics = 2
 regions_consumers = {'n': .0832, 'ne': .2783, 'se': .4213, 's': .1436, 'co': 1 - .0832 - .2783 - .4213 - .1436}
 regions_firms = {'n': 0, 'ne': 3, 'se': 14, 's': 5, 'co': 2}
+# How consumers choose among the cars in their market:
+# 'legacy': shuffle, then sort by a score in which criteria are sampled again for each car. Reproduces published runs
+# 'argmax': criteria are sampled once per consumer, the best car is taken in a single pass with random tie-break
+selection = 'legacy'
+# Demand engine. 'agents': one Consumer.purchase per consumer. 'vectorized': consumers stored as arrays (demand.py)
+demand_engine = 'agents'
+# Consumers scored at once by the vectorized engine. Memory grows with demand_chunk * number of cars
+demand_chunk = 50000
+# Supply engine. 'firms': each firm updates and invests in turn. 'vectorized': accounting and R&D of all firms as
+# array operations (supply.py). Portfolio adoption keeps the shuffled order. Does not reproduce 'firms' runs
+supply_engine = 'firms'
+# Time each phase of a run and count events (see profiler.py). Returned in RunResult.profile
+profile = False
+# Record structured events of firms and government (see events.py). Returned in RunResult.events
+trace = False
 
 # Vehicles characteristics ---------------------------------------------
 production_cost = {'green': 35158, 'hybrid': 23474, 'gas': 18163, 'min': 10000}
@@ -75,13 +90,21 @@ levels = linspace(0, 1, 10)
 # First value refers to max percentage above average emission. Second, minimum
 e_max_max = 2  # 200%
 e_max_min = .2  # 20%
-e_max = {round(levels[i], 1): round(v, 4) for i, v in enumerate(linspace(e_max_max, e_max_min, 10))}
-# Tax applied to e_max até 10%
-e_max_tax = {round(levels[i], 1): round(v, 4) for i, v in enumerate(linspace(0, .1, 10))}
-# IPI. Limited to 3%
-tax = {round(levels[i], 1): round(v, 4) for i, v in enumerate(linspace(0, .03, 10))}
-# Cash back P&D for companies' investments. Limited to 12.5%
-p_d = {round(levels[i], 1): round(v, 3) for i, v in enumerate(linspace(0, .125, 10))}
+
+
+def policy_tables(levels, e_max_max, e_max_min):
+    # Tables of policy values by level. parameters.Parameters rebuilds them when any of their inputs is overridden
+    e_max = {round(levels[i], 1): round(v, 4) for i, v in enumerate(linspace(e_max_max, e_max_min, 10))}
+    # Tax applied to e_max até 10%
+    e_max_tax = {round(levels[i], 1): round(v, 4) for i, v in enumerate(linspace(0, .1, 10))}
+    # IPI. Limited to 3%
+    tax = {round(levels[i], 1): round(v, 4) for i, v in enumerate(linspace(0, .03, 10))}
+    # Cash back P&D for companies' investments. Limited to 12.5%
+    p_d = {round(levels[i], 1): round(v, 3) for i, v in enumerate(linspace(0, .125, 10))}
+    return e_max, e_max_tax, tax, p_d
+
+
+e_max, e_max_tax, tax, p_d = policy_tables(levels, e_max_max, e_max_min)
 
 freight = {'co': {'co': 143, 'ne': 440, 'n': 441, 'se': 232, 's': 273},
            'ne': {'co': 440, 'ne': 154, 'n': 709, 'se': 386, 's': 573},
@@ -0,0 +1,101 @@
+""" Optional instrumentation of a run: wall time and calls of each phase, counters of events.
+    Switched on by params.profile. When off, the simulation holds a NullProfiler, whose calls do nothing
+"""
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+# Phase names. Nested phases are prefixed by their parent
+PHASES = ['offer', 'offer.firms', 'offer.portfolio', 'offer.invest', 'apply_policies', 'offers', 'demand',
+          'demand.market', 'demand.scoring', 'demand.sorting', 'driving']
+# Event counters
+COUNTS = ['cars_scored', 'markets', 'market_cars', 'purchases', 'bankruptcies', 'portfolio_adoptions',
+          'portfolio_abandons']
+
+
+class Phase:
+    """ Reusable timer of one phase, added to its profiler on exit
+    """
+    __slots__ = ['profiler', 'name', 'start']
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.profiler.time[self.name] += time.perf_counter() - self.start
+        self.profiler.calls[self.name] += 1
+
+
+class Profiler:
+    """ Seconds spent and number of calls of each phase, and counts of events, over a whole run
+    """
+    # Counts that cost work of their own are only computed when active
+    active = True
+
+    def __init__(self):
+        self.time = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counts = defaultdict(int)
+        self.phases = dict()
+
+    def phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = Phase(self, name)
+        return self.phases[name]
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def to_dict(self):
+        return {'time': dict(self.time), 'calls': dict(self.calls), 'counts': dict(self.counts)}
+
+
+class NullProfiler:
+    """ Same calls as Profiler, doing nothing
+    """
+    active = False
+    null = nullcontext()
+
+    def phase(self, name):
+        return self.null
+
+    def count(self, name, n=1):
+        pass
+
+    def to_dict(self):
+        return None
+
+
+class ProfileSum:
+    """ Sum of the profiles of many runs, e.g. those of a (policy, level) of a sweep
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.totals = {'time': defaultdict(float), 'calls': defaultdict(int), 'counts': defaultdict(int)}
+
+    def add(self, profile, runs=1):
+        # A profile of one run, or the totals of another ProfileSum
+        self.runs += runs
+        for kind, values in profile.items():
+            for name, v in values.items():
+                self.totals[kind][name] += v
+
+    def to_dict(self):
+        # Totals and means per run
+        return {'runs': self.runs, **{kind: dict(v) for kind, v in self.totals.items()},
+                'mean_time': {k: v / self.runs for k, v in self.totals['time'].items()}}
+
+
+def summary(profile):
+    # Text table of the phases, slowest first, with their share of the top level phases
+    top = sum(v for k, v in profile['time'].items() if '.' not in k)
+    lines = [f'{name:<16}{seconds:>10.3f}s {100 * seconds / top if top else 0:>6.1f}%'
+             for name, seconds in sorted(profile['time'].items(), key=lambda x: -x[1])]
+    lines += [f'{name:<20}{n:>14,}' for name, n in profile['counts'].items()]
+    return '\n'.join(lines)
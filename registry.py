@@ -0,0 +1,97 @@
+import bisect
+
+import numpy as np
+
+
+def weighted_choice(seed, population, cum_weights):
+    """ One item drawn with probability proportional to its weight, given cumulative weights.
+        The same draw as seed.choices(population, cum_weights=cum_weights)[0]. With zero total weights,
+        which random.choices refuses from Python 3.9 on, it behaves as earlier versions did for published runs:
+        one number is drawn and the last item is taken
+    """
+    return population[bisect.bisect(cum_weights, seed.random() * cum_weights[-1], 0, len(population) - 1)]
+
+
+class FirmRegistry:
+    """ Firms of the simulation by id, used as the dict it replaces. Indices by region, by technology held and of
+        entrants are kept up to date as firms are registered, adopt or abandon a technology, and go bankrupt.
+        Firms are registered in id order, so iterating an index follows the order of the whole registry
+    """
+
+    def __init__(self, regions, techs):
+        self.firms = dict()
+        self.by_region = {r: dict() for r in regions}
+        self.by_tech = {t: dict() for t in techs}
+        self.entrants = dict()
+        self.entrant_ids = set()
+        # Changes with every registration or removal. Keys cached cumulative weights
+        self.version = 0
+        self._cumulative = None
+
+    def __getitem__(self, _id):
+        return self.firms[_id]
+
+    def __contains__(self, _id):
+        return _id in self.firms
+
+    def __iter__(self):
+        return iter(self.firms)
+
+    def __len__(self):
+        return len(self.firms)
+
+    def keys(self):
+        return self.firms.keys()
+
+    def values(self):
+        return self.firms.values()
+
+    def items(self):
+        return self.firms.items()
+
+    def __setitem__(self, _id, firm):
+        self.firms[_id] = firm
+        self.by_region[firm.region][_id] = firm
+        for tech in firm.cars:
+            self.by_tech[tech][_id] = firm
+        if _id in self.entrant_ids:
+            self.entrants[_id] = firm
+        self.version += 1
+
+    def __delitem__(self, _id):
+        firm = self.firms.pop(_id)
+        del self.by_region[firm.region][_id]
+        for index in self.by_tech.values():
+            index.pop(_id, None)
+        self.entrants.pop(_id, None)
+        self.version += 1
+
+    def enter(self, firm):
+        # Marks a firm as an entrant, replacing one gone bankrupt
+        self.entrant_ids.add(firm.id)
+        if firm.id in self.firms:
+            self.entrants[firm.id] = firm
+
+    def adopt(self, firm, tech):
+        # Firms not registered are indexed with all their cars once they are
+        if firm.id in self.firms:
+            self.by_tech[tech][firm.id] = firm
+
+    def abandon(self, firm, tech):
+        self.by_tech[tech].pop(firm.id, None)
+
+    def holding(self, tech):
+        # Firms that have a car of this technology, in registry order
+        index = self.by_tech[tech]
+        return [index[i] for i in sorted(index)]
+
+    def cumulative(self, ledger, share, t, firms=None):
+        """ Cumulative market shares (ledger column share, at t) of firms, all of them by default.
+            Those of all firms are kept until a firm is registered or removed, or t changes
+        """
+        if firms is not None:
+            return np.cumsum(ledger.market_share[[f.row for f in firms], share, t]).tolist()
+        if self._cumulative is None or self._cumulative[:3] != (self.version, share, t):
+            weights = ledger.market_share[[f.row for f in self.firms.values()], share, t]
+            self._cumulative = self.version, share, t, np.cumsum(weights).tolist()
+        return self._cumulative[3]
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+# 'emissions' is total value, 'emissions_index' is relative to first month emissions
+# 'e' is the calculated parameter benchmark, based on sold vehicles and their energy economy
+COLUMNS = ['green_market_share', 'hybrid_market_share', 'new_firms_share',
+           'emissions', 'emissions_index', 'e',
+           'public', 'public_index', 'public_cumulative']
+
+
+class Report:
+    """ Indicators of a run. A float64 buffer of shape (T, metrics) written in place at each t.
+        Values never written stay NaN. A pandas view is only built when asked for
+    """
+
+    def __init__(self, periods, regions):
+        self.columns = COLUMNS + ['public_' + r for r in regions]
+        self.index = {c: j for j, c in enumerate(self.columns)}
+        self.values = np.full((periods, len(self.columns)), np.nan)
+
+    def __setitem__(self, key, value):
+        t, col = key
+        self.values[t, self.index[col]] = value
+
+    def __getitem__(self, key):
+        t, col = key
+        return self.values[t, self.index[col]]
+
+    def column(self, col, periods=None):
+        return self.values[:periods, self.index[col]]
+
+    def frame(self, periods=None):
+        # Rows 0 to periods - 1, sharing memory with the buffer
+        return pd.DataFrame(self.values[:periods], columns=self.columns, copy=False)
+
+
+class RunResult:
+    """ Compact record of a finished run, cheap to send back from a worker process.
+        Holds selected metrics at selected ticks and, optionally, the full numeric report. Never the agents
+    """
+
+    def __init__(self, report, policy, param=None, value=None, metrics=None, ticks=None, full=False):
+        self.policy = policy['policy']
+        self.level = policy['level']
+        self.param = param
+        self.value = value
+        # Seed stream (root seed, spawn key) when the run had one of its own
+        self.stream = None
+        # Phase times and event counts, when params.profile is on. See profiler.py
+        self.profile = None
+        # Event columns, when tracing is on. See events.py
+        self.events = None
+        # Defaults: every metric at the last tick
+        self.metrics = list(report.columns) if metrics is None else list(metrics)
+        self.ticks = [len(report.values) - 1] if ticks is None else list(ticks)
+        self.values = report.values[np.ix_(self.ticks, [report.index[m] for m in self.metrics])].copy()
+        self.columns = list(report.columns) if full else None
+        self.report = report.values.copy() if full else None
+
+    def at(self, tick):
+        # Selected metrics at one of the selected ticks
+        return pd.Series(self.values[self.ticks.index(tick)], index=self.metrics, name=tick)
+
+    def frame(self):
+        # Full report, when it was kept
+        return pd.DataFrame(self.report, columns=self.columns)
@@ -0,0 +1,85 @@
+""" Columnar store of full run reports, written as a sweep streams in.
+    <path>/meta.json: metric names and number of ticks
+    <path>/keys_<k>.npy: typed keys of the runs of chunk k (policy, level, replicate, param, value)
+    <path>/report_<k>.npy: float64 array (runs, T, metrics) of chunk k
+"""
+import glob
+import json
+import os
+
+import numpy as np
+
+KEYS = np.dtype([('policy', 'U8'), ('level', 'f8'), ('replicate', 'i8'), ('param', 'U32'), ('value', 'f8')])
+
+
+class ResultStore:
+    """ Appends the numeric report of each finished run. Runs are buffered and written chunk by chunk
+    """
+
+    def __init__(self, path, chunk=1000):
+        self.path = path
+        self.chunk = chunk
+        os.makedirs(path, exist_ok=True)
+        self.n_chunks = len(glob.glob(os.path.join(path, 'keys_*.npy')))
+        self.columns = None
+        self.keys = list()
+        self.reports = list()
+
+    def append(self, task, result):
+        pol, level, i = task[:3]
+        if self.columns is None:
+            self.columns = result.columns
+            with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+                json.dump({'columns': self.columns, 'T': len(result.report)}, f)
+        self.keys.append((str(pol), level, i, result.param or '', np.nan if result.value is None else result.value))
+        self.reports.append(result.report)
+        if len(self.keys) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        if not self.keys:
+            return
+        # Report first: a chunk only counts once its keys exist
+        np.save(os.path.join(self.path, f'report_{self.n_chunks}.npy'), np.stack(self.reports))
+        np.save(os.path.join(self.path, f'keys_{self.n_chunks}.npy'), np.array(self.keys, dtype=KEYS))
+        self.n_chunks += 1
+        self.keys, self.reports = list(), list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+
+class StoreReader:
+    """ Lazy access to a ResultStore. Keys are loaded, reports are memory-mapped and only read when sliced
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.columns = meta['columns']
+        self.T = meta['T']
+        n_chunks = len(glob.glob(os.path.join(path, 'keys_*.npy')))
+        keys = [np.load(os.path.join(path, f'keys_{k}.npy')) for k in range(n_chunks)]
+        self.reports = [np.load(os.path.join(path, f'report_{k}.npy'), mmap_mode='r') for k in range(n_chunks)]
+        self.keys = np.concatenate(keys) if keys else np.array([], dtype=KEYS)
+        # Chunk and position of each run
+        self.chunk = np.concatenate([np.full(len(k), j) for j, k in enumerate(keys)]) if keys else np.array([], int)
+        self.row = np.concatenate([np.arange(len(k)) for k in keys]) if keys else np.array([], int)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def select(self, metric=None, tick=None, **keys):
+        """ Values of the runs matching keys, e.g. select('emissions', 39, policy='tax', level=1.0).
+            Returns an array (runs, ticks, metrics), with the dimensions asked for dropped
+        """
+        mask = np.ones(len(self.keys), dtype=bool)
+        for k, v in keys.items():
+            mask &= self.keys[k] == (str(v) if k == 'policy' else v)
+        idx = slice(None) if metric is None else self.columns.index(metric)
+        t = slice(None) if tick is None else tick
+        runs = np.flatnonzero(mask)
+        return np.array([self.reports[self.chunk[r]][self.row[r], t, idx] for r in runs])
@@ -0,0 +1,98 @@
+import numpy as np
+
+from ledger import SHARES, TECHS
+
+# Improvement of a car chosen on R&D success, as in Firm.invest_into_vehicle
+COST, EFFICIENCY, QUALITY = 1, 2, 3
+
+
+class Supply:
+    """ Vectorized supply engine. Profit, market shares and budgets of all firms are computed at once, and R&D
+        draws its randoms in bulk. Only portfolio adoption, which spends budgets and copies other firms' cars,
+        still runs firm by firm in the shuffled order
+    """
+
+    def __init__(self, sim):
+        self.rng = np.random.default_rng(sim.streams['invest'].getrandbits(64))
+
+    def offer(self, sim, keys, total_cars_sold):
+        # Same steps as the loop of Simulation.offer. Returns the ids of the firms gone bankrupt
+        firms = [sim.firms[key] for key in keys]
+        rows = np.array([f.row for f in firms], dtype=int)
+        held = np.array([[tech in f.cars for tech in TECHS] for f in firms], dtype=bool).reshape((len(firms),
+                                                                                                  len(TECHS)))
+        ledger, t = sim.ledger, sim.t
+        with sim.profiler.phase('offer.firms'):
+            if t > 0:
+                sold = ledger.sold_cars[rows, :, t - 1]
+                # Number of cars sold times sales price minus production cost and taxes
+                margin = np.array([[f.cars[tech].sales_price - f.cars[tech].production_cost - f.cars[tech].owed_taxes
+                                    if tech in f.cars else 0 for tech in TECHS] for f in firms]).reshape(held.shape)
+                ledger.profit[rows, :, t] += np.where(held, sold * margin, 0)
+                num_cars = np.array([sim.num_cars[tech][t - 1] for tech in TECHS])
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    ledger.market_share[rows, :len(TECHS), t] = np.where(held & (num_cars > 0), sold / num_cars, 0)
+                ledger.market_share[rows, SHARES['total'], t] = sold.sum(axis=1) / total_cars_sold \
+                    if total_cars_sold > 0 else 0
+            budget = np.array([f.budget for f in firms], dtype=float) + \
+                np.where(held, ledger.profit[rows, :, t], 0).sum(axis=1) - (sim.params.fixed_costs if t != 0 else 0)
+            for f, b in zip(firms, budget.tolist()):
+                f.budget = b
+        landfill = [f.id for f, b in zip(firms, budget) if b < 0]
+        active = [f for f, b in zip(firms, budget) if b >= 0]
+        if t > 9:
+            with sim.profiler.phase('offer.portfolio'):
+                # If portfolio is changed, costs of adoption apply
+                for f in active:
+                    f.change_portfolio()
+                    f.abandon_portfolio()
+        with sim.profiler.phase('offer.invest'):
+            self.invest(sim, [f for f in active if f.budget > 0])
+        return landfill
+
+    def invest(self, sim, firms):
+        # Firm.invest_rd and Firm.invest_into_vehicle of all firms, over arrays of (firm, tech) pairs
+        pairs = [(j, f, tech, car) for j, f in enumerate(firms) for tech, car in f.cars.items()]
+        if not pairs:
+            return
+        params, ledger, t = sim.params, sim.ledger, sim.t
+        mu = self.rng.uniform(0, params.mu_max, len(firms))
+        budget = np.array([f.budget for f in firms], dtype=float)
+        to_invest = np.maximum(mu * budget, params.rd_min) / np.array([len(f.cars) for f in firms])
+        j = np.array([p[0] for p in pairs])
+        rows = np.array([p[1].row for p in pairs])
+        techs = np.array([TECHS[p[2]] for p in pairs])
+        amount = to_invest[j]
+        rdm = self.rng.random(len(pairs))
+        choice = self.rng.integers(COST, QUALITY + 1, len(pairs))
+        success = rdm < 1 - np.exp(-params.alpha1 * amount)
+        ledger.investments[rows[success], techs[success], t] += amount[success]
+        spent = np.bincount(j[success], weights=amount[success], minlength=len(firms))
+        for f, s in zip(firms, spent.tolist()):
+            f.budget -= s
+
+        cars = [p[3] for p in pairs]
+        production_cost = np.array([c.production_cost for c in cars])
+        quality = np.array([c.QL for c in cars])
+        economy = np.array([c.EE for c in cars])
+        capacity = np.array([c.EC for c in cars])
+        gas = techs == TECHS['gas']
+        # Which attribute improves, if not at its limit yet
+        cases = [success & (choice == COST) & (production_cost >= params.production_cost['min']),
+                 success & (choice == QUALITY) & (quality <= params.quality_level['max']),
+                 success & (choice == EFFICIENCY) & gas & (economy <= params.energy_economy['max']),
+                 success & (choice == EFFICIENCY) & ~gas & (capacity <= params.energy_capacity['max'])]
+        delta = params.alpha2 * rdm * np.select(cases, [params.production_cost['min'] - production_cost,
+                                                        params.quality_level['max'] - quality,
+                                                        params.energy_economy['max'] - economy,
+                                                        params.energy_capacity['max'] - capacity], 0)
+        which = np.select(cases, [0, 1, 2, 3], -1)
+        names = ['production_cost', 'QL', 'EE', 'EC']
+        events = ['cost_reduction', 'quality', 'energy_economy', 'energy_capacity']
+        for k in np.flatnonzero(success).tolist():
+            if sim.trace:
+                sim.trace('investment', t, pairs[k][1].id, pairs[k][2], float(amount[k]))
+            if which[k] >= 0:
+                setattr(cars[k], names[which[k]], getattr(cars[k], names[which[k]]) + float(delta[k]))
+                if sim.trace:
+                    sim.trace(events[which[k]], t, pairs[k][1].id, pairs[k][2], float(delta[k]))
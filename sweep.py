@@ -0,0 +1,156 @@
+""" Scheduling of many runs over one process pool
+"""
+import math
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+
+import model
+from aggregate import OnlineStats
+from parameters import override
+
+# Fixed positions, so that the spawn key of a policy never changes when the list of policies run changes
+POLICIES = [None, 'tax', 'p_d', 'e_max']
+
+
+def grid(pols, levels, n, param=None, values=None):
+    """ Every (policy, level, replicate) of a sweep, as a flat list of tasks.
+        With param and values, every (policy, level, replicate, param, value): a sensitivity analysis in one sweep
+    """
+    if param is None:
+        return [(pol, level, i) for pol in pols for level in levels for i in range(n)]
+    return [(pol, level, i, param, value) for value in values for pol in pols for level in levels for i in range(n)]
+
+
+def overrides(task, param=None, value=None):
+    # Sensitivity override of a task: its own if it carries one, else the one of the sweep
+    return task[3:] if len(task) > 3 else (param, value)
+
+
+def canonical(pol, level, param=None, value=None, params=None):
+    """ Scenario actually run by (policy, level), given the effective parameters (params, if already built).
+        The level of the baseline has no effect. A tax of 0 or a P&D cashback of 0 are the baseline
+    """
+    if pol is None:
+        return None, 0.0
+    if params is None:
+        params = override(param, value)
+    if pol == 'tax' and params.tax[level] == 0:
+        return None, 0.0
+    if pol == 'p_d' and level == 0:
+        # The cashback rate is the level itself. See Simulation.apply_policies
+        return None, 0.0
+    return pol, level
+
+
+def stream(root, task, param=None, value=None, crn=False):
+    """ Seed sequence of a single run, derived from the root seed of the sweep.
+        Each (policy, level, replicate, sensitivity value) gets its own independent stream.
+        With common random numbers (crn), replicate i of every policy and level shares the same stream
+    """
+    pol, level, i = task[:3]
+    param, value = overrides(task, param, value)
+    sensitivity = zlib.crc32(f'{param}={value}'.encode()) if param else 0
+    if crn:
+        return np.random.SeedSequence(root, spawn_key=(len(POLICIES), 0, i, sensitivity))
+    # The exact level is hashed, so that levels off the 0.1 grid (0.2 and 0.25) never share a stream
+    return np.random.SeedSequence(root, spawn_key=(POLICIES.index(pol), zlib.crc32(repr(float(level)).encode()), i,
+                                                   sensitivity))
+
+
+def work(task, verbose=False, seed=True, param=None, value=None, metrics=None, ticks=None, full=False, root=None,
+         crn=False):
+    pol, level, i = task[:3]
+    param, value = overrides(task, param, value)
+    if root is not None:
+        seed = stream(root, task, param, value, crn)
+    return task, model.run({'policy': pol, 'level': level}, verbose, seed, param, value, metrics, ticks, full)
+
+
+def execute(tasks, n_jobs=1, batch_size='auto', cache=None, **kwargs):
+    """ Runs all tasks on a single pool, handing them out in batches as workers free up.
+        Yields (task, RunResult) as soon as each run finishes, in completion order.
+        With root=<int> every run has its own reproducible seed stream, recorded in RunResult.stream.
+        With crn=True as well, replicate i of all policy arms shares its streams, for paired comparisons.
+        With a RunCache, runs already on disk are yielded first and are not run again. Unseeded runs (seed=False
+        and no root) are never cached.
+        Tasks that are the same scenario (see canonical) run once, the result is yielded for each of them.
+        Tasks of grid(..., param, values) carry their own parameters, so a whole sensitivity analysis shares the pool
+    """
+    # Parameters of each distinct sensitivity point, built once rather than for every task
+    built = dict()
+    labels = defaultdict(list)
+    for task in tasks:
+        pol, level, i = task[:3]
+        point = overrides(task, kwargs.get('param'), kwargs.get('value'))
+        if point not in built:
+            built[point] = override(*point)
+        labels[canonical(pol, level, params=built[point]) + task[2:]].append(task)
+    seed = kwargs.get('seed', True)
+    if kwargs.get('root') is None and (seed is False or seed is None):
+        # Unseeded runs are fresh random draws. Served from the cache, they would repeat earlier samples
+        cache = None
+    keys = {task: cache.key(task, params=built[overrides(task, kwargs.get('param'), kwargs.get('value'))], **kwargs)
+            for task in labels} if cache is not None else dict()
+    pending = list()
+    for task in labels:
+        result = cache.get(keys[task]) if cache is not None else None
+        if result is None:
+            pending.append(task)
+        else:
+            for label in labels[task]:
+                yield label, result
+    parallel = Parallel(n_jobs=n_jobs, batch_size=batch_size, return_as='generator_unordered')
+    for task, result in parallel(delayed(work)(task, **kwargs) for task in pending):
+        # Stored as soon as it arrives, so that an interrupted sweep resumes from here
+        if cache is not None:
+            cache.put(keys[task], result)
+        for label in labels[task]:
+            yield label, result
+
+
+def adaptive(scenarios, tolerance, n_jobs=1, min_runs=10, max_runs=2000, batch=10, confidence=.95, stop=None,
+             **kwargs):
+    """ Runs replicates of each (policy, level) scenario in rounds, until the confidence interval half width of
+        the mean of every metric in tolerance ({metric: half width}) is within tolerance, at the last tick.
+        Scenarios stop between min_runs and max_runs. Each round only runs the scenarios not converged yet,
+        so the whole pool moves to them. With crn, the baseline of a level stops only after all its arms.
+        stop(pol, level, n) is called as each scenario stops, after its n-th replicate was yielded (see
+        Aggregator.stop). Yields (task, RunResult) as execute does
+    """
+    stats = {s: OnlineStats((len(tolerance), )) for s in scenarios}
+    limits = np.array(list(tolerance.values()))
+    runs = dict.fromkeys(scenarios, 0)
+    active = list(scenarios)
+    stopped = set()
+    while active:
+        # Rounds of at least two tasks per worker, shared among the scenarios left
+        size = max(batch, math.ceil(2 * effective_n_jobs(n_jobs) / len(active)))
+        tasks = [(pol, level, i) for pol, level in active
+                 for i in range(runs[pol, level], min(runs[pol, level] + size, max_runs))]
+        for task, result in execute(tasks, n_jobs, **kwargs):
+            pol, level = task[:2]
+            tick = result.ticks.index(result.ticks[-1])
+            stats[pol, level].update([result.values[tick, result.metrics.index(m)] for m in tolerance])
+            yield task, result
+        for s in active:
+            runs[s] = min(runs[s] + size, max_runs)
+        active = [s for s in active if runs[s] < max_runs and
+                  (runs[s] < min_runs or not np.all(stats[s].half_width(confidence) <= limits))]
+        if kwargs.get('crn'):
+            # Paired arms need the baseline replicate of the same index: it runs as long as any arm at its level
+            levels = {level for pol, level in active if pol is not None}
+            active += [(None, level) for level in levels if (None, level) in runs and (None, level) not in active]
+        if stop is not None:
+            for s in [s for s in runs if s not in active and s not in stopped]:
+                stopped.add(s)
+                stop(*s, runs[s])
+
+
+def replay(result, verbose=False):
+    # Runs again, alone, the run that produced a RunResult. Returns the whole Simulation, for debugging
+    entropy, spawn_key = result.stream
+    return model.main({'policy': result.policy, 'level': result.level}, verbose,
+                      np.random.SeedSequence(entropy, spawn_key=spawn_key), result.param, result.value)